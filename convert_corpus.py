@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Use this script to convert a corpus between the directory layout with one
+file per post and the packed layout (see reddit/packed_corpus.py).
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser(description='converts a corpus between the '
+        'directory and the packed layout')
+parser.add_argument('-i', '--input-directory', required=True,
+        help='Input directory')
+parser.add_argument('-o', '--output-directory', required=True,
+        help='Output directory')
+parser.add_argument('-t', '--to', choices=['packed', 'directory'], required=True,
+        help='layout of the output corpus')
+args = parser.parse_args()
+
+import os
+import sys
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reddit'))
+from packed_corpus import create_writer, open_corpus
+
+if os.path.exists(args.output_directory):
+    parser.error(f'{args.output_directory} already exists')
+
+corpus = open_corpus(args.input_directory)
+writer = create_writer(args.output_directory, packed=args.to == 'packed')
+for target in tqdm(corpus.targets()):
+    for group in corpus.groups(target):
+        for post in corpus.posts(target, group):
+            writer.write(target, group, post, corpus.read_text(target, group, post))
+writer.close()
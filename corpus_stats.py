@@ -3,13 +3,26 @@
 
 import glob
 import os
+import sys
 import argparse
 from collections import defaultdict
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reddit'))
+from packed_corpus import open_corpus
+from parallel import map_tasks
+from sketches import Summary
+
+AUTHORS_PER_TASK = 100
+PERCENTILES = (5, 25, 50, 75, 90, 95, 99)
+
 parser = argparse.ArgumentParser(description="")
 parser.add_argument('-i', '--input-directory', required=True, help='Input directory')
 parser.add_argument('--single', action="store_true", help='')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes that scan the authors')
+parser.add_argument('--json', default=None, help='also write the statistics with the length distributions per topic to this JSON file')
+parser.add_argument('--per-author', action='store_true', help='add the length distribution of every author to the JSON file')
+parser.add_argument('--progress', action='store_true', help='show a progress bar')
 args = parser.parse_args()
 
 if args.single:
@@ -38,29 +51,62 @@ if args.single:
 
 
 
+def describe(summary):
+    """The distribution of the lengths in a summary, for the JSON report."""
+    return {
+        'count': summary.moments.count,
+        'mean': summary.moments.mean(),
+        'std': summary.moments.variance() ** 0.5,
+        'min': summary.moments.min,
+        'max': summary.moments.max,
+        'percentiles': {str(p): summary.quantiles.quantile(p / 100) for p in PERCENTILES},
+        'histogram': summary.histogram.to_dict(),
+    }
+
+
+def process_authors(authors):
+    """Returns the number of documents and their total length per topic of
+    every author, the length summaries per topic and, with --per-author,
+    the length distribution of every author."""
+    documents = []
+    topic_summaries = defaultdict(Summary)
+    author_distributions = {}
+    for author in authors:
+        author_documents = {}
+        author_summary = Summary()
+        for topic in corpus.groups(author):
+            lengths = [corpus.body_length(author, topic, document)
+                       for document in corpus.posts(author, topic)]
+            author_documents[topic] = (len(lengths), sum(lengths))
+            topic_summaries[topic].update(lengths)
+            if args.per_author:
+                author_summary.update(lengths)
+        documents.append(author_documents)
+        if args.per_author:
+            author_distributions[author] = describe(author_summary)
+    return documents, topic_summaries, author_distributions
+
+
 data = {}
-authors = sorted(os.listdir(args.input_directory))
+corpus = open_corpus(args.input_directory)
+# without a length manifest, the workers read the lengths from the documents
+corpus.load_lengths(build=False)
+authors = corpus.targets()
 data['authors'] = len(authors)
 topicdata = defaultdict(list)
 topicsizedata = defaultdict(list)
-for author in authors:
-    author_dir = os.path.join(args.input_directory, author)
-    if not os.path.isdir(author_dir): 
-        continue
-    topics = sorted(os.listdir(author_dir))
-    for topic in topics:
-        topic_dir = os.path.join(author_dir, topic)
-        documents = sorted(os.listdir(topic_dir))
-        documents = [x for x in documents if '.json' in x]
-        topicdata[topic].append(len(documents))
-        doclengths = 0
-        for document in documents:
-            fullpath = os.path.join(topic_dir, document)
-            with open(fullpath) as i_f:
-                doclength= len(json.loads(i_f.read())['body'])
-                doclengths += doclength
-        avg_doc_length = doclengths/len(documents)
-        topicsizedata[topic].append(avg_doc_length)
+topic_summaries = defaultdict(Summary)
+author_distributions = {}
+chunks = [authors[i:i + AUTHORS_PER_TASK] for i in range(0, len(authors), AUTHORS_PER_TASK)]
+for documents, summaries, distributions in map_tasks(process_authors, chunks, args.jobs, disable=not args.progress):
+    for author_documents in documents:
+        for topic, (n_documents, doclengths) in author_documents.items():
+            topicdata[topic].append(n_documents)
+            avg_doc_length = doclengths/n_documents
+            topicsizedata[topic].append(avg_doc_length)
+    for topic, summary in summaries.items():
+        topic_summaries[topic].merge(summary)
+    author_distributions.update(distributions)
 
 avg_docs = 0
 for documents in topicdata.values():
@@ -73,3 +119,15 @@ for documents in topicsizedata.values():
 data['avg_doc_length'] = avg_docs_size / len(topicsizedata)
 
 print(data)
+
+if args.json:
+    all_documents = Summary()
+    for summary in topic_summaries.values():
+        all_documents.merge(summary)
+    report = dict(data)
+    report['documents'] = describe(all_documents)
+    report['topics'] = {topic: describe(summary) for topic, summary in sorted(topic_summaries.items())}
+    if args.per_author:
+        report['author_distributions'] = author_distributions
+    with open(args.json, 'w') as o_f:
+        json.dump(report, o_f, indent=1)
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import json
 import argparse
 import glob
@@ -11,10 +12,19 @@ from collections import defaultdict
 
 import tqdm 
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reddit'))
+from columnar import read_fields
+from sketches import HeavyHitters, HyperLogLog, Summary
+
+# document lengths (and authors and subreddits with --sketch) are added to
+# the sketches in batches of this size
+BATCH_SIZE = 100000
+
 parser = argparse.ArgumentParser(description="")
 parser.add_argument('-i', '--input-directory', required=True, help='Input directory')
 parser.add_argument('-o', '--output-directory', required=True, help='Output directory')
 parser.add_argument('-j', '--jobs', type=int, default=10, help='number of concurrent jobs')
+parser.add_argument('--sketch', action='store_true', help='store a HyperLogLog and the heavy hitters of authors and subreddits instead of exact counts of all of them')
 args = parser.parse_args()
 
 if not os.path.isdir(args.output_directory): 
@@ -29,29 +39,49 @@ def process_split_directory(directory):
     languages = defaultdict(int)
     subreddits = defaultdict(int)
     doc_lengths = []
+    doc_length_summary = Summary()
+    author_batch = []
+    subreddit_batch = []
+    author_sketch = {'cardinality': HyperLogLog(), 'top': HeavyHitters()}
+    subreddit_sketch = {'cardinality': HyperLogLog(), 'top': HeavyHitters()}
+
+    def update_sketches():
+        doc_length_summary.update(doc_lengths)
+        for batch, sketch in ((author_batch, author_sketch), (subreddit_batch, subreddit_sketch)):
+            sketch['cardinality'].update(batch)
+            sketch['top'].update(batch)
 
+    fields = ['author', 'language', 'subreddit', 'body_clean_length']
     for f in files:
-        with open(f) as input_fh:
-            for line in input_fh:
-                try: 
-                    js = json.loads(line)
-                    authors[js['author']] += 1
-                    languages[js['language']] += 1
-                    subreddits[js['subreddit']] += 1
-                    doc_lengths.append(len(js['body_clean']))
-                    no_documents += 1
-                    del js
-                except Exception:
-                    pass
+        for author, language, subreddit, doc_length in read_fields(f, fields, skip_errors=True):
+            if args.sketch:
+                author_batch.append(author)
+                subreddit_batch.append(subreddit)
+            else:
+                authors[author] += 1
+                subreddits[subreddit] += 1
+            languages[language] += 1
+            doc_lengths.append(doc_length)
+            no_documents += 1
+            if len(doc_lengths) >= BATCH_SIZE:
+                update_sketches()
+                doc_lengths.clear()
+                author_batch.clear()
+                subreddit_batch.clear()
+    update_sketches()
 
     with open(output_file, 'w') as output_fh:
         payload = {
             'no_documents': no_documents,
-            'authors': authors,
-            'subreddits': subreddits,
             'languages': languages,
-            'doc_lengths': doc_lengths,
+            'doc_length_summary': doc_length_summary.to_dict(),
         }
+        if args.sketch:
+            payload['author_sketch'] = {k: v.to_dict() for k, v in author_sketch.items()}
+            payload['subreddit_sketch'] = {k: v.to_dict() for k, v in subreddit_sketch.items()}
+        else:
+            payload['authors'] = authors
+            payload['subreddits'] = subreddits
         json.dump(payload, output_fh)
 
 all_files = sorted(glob.glob(f'{args.input_directory}/RC_*'))
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import glob
 import argparse
 import tqdm
@@ -8,33 +10,94 @@ import json
 import numpy as np
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reddit'))
+from sketches import HeavyHitters, HyperLogLog, Summary
+
 parser = argparse.ArgumentParser(description="")
 parser.add_argument('-i', '--input-pattern', required=True, help='Input pattern')
+parser.add_argument('-k', '--top', type=int, default=0, help='also list this many of the most active authors and subreddits')
 args = parser.parse_args()
 
 input_stat_files = sorted(glob.glob(args.input_pattern))
 
 all_authors = defaultdict(int)
 subreddits = defaultdict(int)
+# stats files written with --sketch only have sketches of the authors and
+# subreddits, the exact counts of other files are added to them
+author_sketch = None
+subreddit_sketch = None
 document_count = 0
-document_lengths = []
+document_lengths = Summary()
+
+
+def merge_sketch(sketch, data):
+    other = {'cardinality': HyperLogLog.from_dict(data['cardinality']),
+             'top': HeavyHitters.from_dict(data['top'])}
+    if sketch is None:
+        return other
+    for name, value in other.items():
+        sketch[name].merge(value)
+    return sketch
+
+
+def add_counts(sketch, counts):
+    sketch['cardinality'].update(counts.keys())
+    sketch['top'].update_counts(counts)
+
 
 for f in tqdm.tqdm(input_stat_files): 
     with open(f) as input_fh:
         js = json.load(input_fh)
         document_count += js['no_documents']
 
-        for author, count in js['authors'].items():
-            all_authors[author] += count
+        if 'author_sketch' in js:
+            author_sketch = merge_sketch(author_sketch, js['author_sketch'])
+            subreddit_sketch = merge_sketch(subreddit_sketch, js['subreddit_sketch'])
+        else:
+            for author, count in js['authors'].items():
+                all_authors[author] += count
+
+            for sub, count in js['subreddits'].items(): 
+                subreddits[sub] += count
 
-        for sub, count in js['subreddits'].items(): 
-            subreddits[sub] += count
+        if 'doc_length_summary' in js:
+            document_lengths.merge(Summary.from_dict(js['doc_length_summary']))
+        else:
+            # stats files of older versions have all the lengths
+            document_lengths.update(js['doc_lengths'])
 
-        document_lengths += js['doc_lengths']
+if author_sketch is not None:
+    add_counts(author_sketch, all_authors)
+    add_counts(subreddit_sketch, subreddits)
+    author_count = round(author_sketch['cardinality'].cardinality())
+    subreddit_count = round(subreddit_sketch['cardinality'].cardinality())
+    top_authors = author_sketch['top'].top(args.top)
+    top_subreddits = subreddit_sketch['top'].top(args.top)
+else:
+    author_count = len(all_authors)
+    subreddit_count = len(subreddits)
+    top_authors = sorted(all_authors.items(), key=lambda x: x[1], reverse=True)[:args.top]
+    top_subreddits = sorted(subreddits.items(), key=lambda x: x[1], reverse=True)[:args.top]
 
+if author_sketch is not None:
+    print('AUTHORS and SUBREDDITS are estimated with a standard error of '
+          f'{1.04 / np.sqrt(len(author_sketch["cardinality"].registers)):.2%}')
 print(f'COMMENTS:     {document_count:12d}')
-print(f'AUTHORS:      {len(all_authors):12d}')
-print(f'SUBREDDITS:   {len(subreddits):12d}')
-print(f'AVG DOC/AUTH: {document_count/len(all_authors):12.3f}')
-print(f'AVG DOCSIZE:  {np.mean(np.array(document_lengths)):12.0f}')
+print(f'AUTHORS:      {author_count:12d}')
+print(f'SUBREDDITS:   {subreddit_count:12d}')
+print(f'AVG DOC/AUTH: {document_count/author_count:12.3f}')
+print(f'AVG DOCSIZE:  {document_lengths.moments.mean():12.0f}')
+print(f'STD DOCSIZE:  {np.sqrt(document_lengths.moments.variance()):12.0f}')
+print(f'MED DOCSIZE:  {document_lengths.quantiles.quantile(0.5):12.0f}')
+print(f'P90 DOCSIZE:  {document_lengths.quantiles.quantile(0.9):12.0f}')
+print(f'P99 DOCSIZE:  {document_lengths.quantiles.quantile(0.99):12.0f}')
 
+for name, top, sketch in (('AUTHORS', top_authors, author_sketch),
+                          ('SUBREDDITS', top_subreddits, subreddit_sketch)):
+    if not top:
+        continue
+    print(f'TOP {name}:')
+    if sketch is not None:
+        print(f'  (counts are underestimated by at most {sketch["top"].error_bound():.0f})')
+    for value, count in top:
+        print(f'  {value:24s}{count:12d}')
@@ -16,20 +16,27 @@
 
 import argparse
 import glob
+import itertools
 import json
 import logging
 import multiprocessing as mp
 import os
 import re
-import string
+import shutil
 from collections import defaultdict
 
 import hoep as h
 import tqdm
 from bs4 import BeautifulSoup as BS
-from langdetect import detect_langs
 
-from bots import botlist
+import columnar
+from bot_detection import create_detector
+from cleaning import clean_and_tokenize
+from compression import (CODECS, add_codec_extension, detect_codec, open_input,
+                         open_output, strip_codec_extension)
+from duplicates import KeySet, comment_keys
+from language_id import create_identifier
+from markdown_text import markdown_to_text, rendered_to_text
 
 logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s: %(message)s')
 
@@ -38,55 +45,106 @@ parser.add_argument('-i', '--input-pattern', required=True, help='glob pattern c
 parser.add_argument('-o', '--output-directory', required=True, help='Output directory')
 parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
 parser.add_argument('-p', '--lang-detect-probability', default=0.99, type=float, help='Minimum probability of language detection to keep a comment')
+parser.add_argument('--lang-id', choices=['langdetect', 'ngram'], default='langdetect', help='language identification backend [langdetect]')
+parser.add_argument('--lang-id-batch-size', type=int, default=64, help='number of comments scored together by the language identification [64]')
+parser.add_argument('--lang-id-languages', default=None, help='comma separated languages the ngram backend can detect [all]')
+parser.add_argument('--lang-detect-seed', type=int, default=None, help='seed for langdetect, which is not deterministic otherwise')
 parser.add_argument('-ct','--post-characters-threshold', type=int, default=1000, help='Minimum post length (characters)')
 parser.add_argument('-wt','--post-words-threshold', type=int, default=50, help='Minimum post length (words)')
 parser.add_argument('-vt', '--post-vocabulary-threshold', type=int, default=20, help='minimum vocabulary richness')
+parser.add_argument('-cs', '--chunk-size', type=int, default=None, help='split uncompressed input files into chunks of this many megabytes and filter the chunks in parallel')
+parser.add_argument('--markdown-engine', choices=['hoep', 'fast'], default='hoep', help='how to strip markdown: parse the HTML rendered by hoep with BeautifulSoup, or extract the text without building a DOM where the result is guaranteed to be the same [hoep]')
+parser.add_argument('--prefilter', action='store_true', help='reject short comments and bots on the raw JSON line before parsing it. The skipped checks of these lines are not counted in the statistics')
+parser.add_argument('--checkpoint-interval', type=int, default=1000000, help='number of input lines after which the progress of a file is saved, so that it can be resumed after a crash [1000000]')
+parser.add_argument('-f', '--output-format', choices=['jsonl', 'parquet'], default='jsonl', help='write JSON lines, or columnar parquet files that the later stages can read without parsing the comment bodies [jsonl]')
+parser.add_argument('--bot-list', action='append', default=[], help='file with more bot names or name patterns, one per line (can be given several times)')
+parser.add_argument('--bot-patterns', default=None, help='comma separated bot name patterns, where * matches any characters, e.g. "*_bot,*bot" [None]')
+parser.add_argument('--bot-ignore-case', action='store_true', help='match bot names and patterns case-insensitively')
+parser.add_argument('--dedupe', action='store_true', help='remove exact duplicates (same id and body_clean) from the output files after filtering, keeping the first one in the order of the input files')
+parser.add_argument('-z', '--compress-output', choices=sorted(set(CODECS.values())), default=None, help='compress the output files with this codec')
 args = parser.parse_args()
 
+if args.output_format == 'parquet' and args.compress_output:
+    parser.error('--compress-output only applies to jsonl output, parquet files are compressed internally')
+
+lang_id_languages = None
+if args.lang_id_languages:
+    lang_id_languages = args.lang_id_languages.split(',')
+identifier = create_identifier(args.lang_id, seed=args.lang_detect_seed, languages=lang_id_languages)
+
+bot_patterns = args.bot_patterns.split(',') if args.bot_patterns else []
+bots = create_detector(args.bot_list, bot_patterns, args.bot_ignore_case)
+
 logging.info('reading file list')
 files = sorted(glob.glob(args.input_pattern), reverse=False)
 logging.info(f'read {len(files)} files, starting work')
 
 def remove_markdown(text):
+    if args.markdown_engine == 'fast':
+        plain = markdown_to_text(text)
+        if plain is not None:
+            return plain
     html = h.render(text)
+    if args.markdown_engine == 'fast':
+        plain = rendered_to_text(text, html)
+        if plain is not None:
+            return plain
     return BS(html, features='lxml').get_text()
 
-def remove_citations(text):
-    lines = text.split('\n')
-    return '\n'.join([x for x in lines if not x.startswith('>')])
-
-def remove_urls(text): 
-    return re.sub('\S*https?:\/\/\S+', '<URL>', text, flags=re.MULTILINE)
-
 def clean(text):
-    text = remove_markdown(text)
-    text = remove_citations(text)
-    text = remove_urls(text)
-    return text
+    """Returns the cleaned text, its number of words and its number of
+    distinct words."""
+    return clean_and_tokenize(remove_markdown(text))
 
 def not_enough_characters(msg): 
     return len(msg['body_clean']) < args.post_characters_threshold
 
-def not_enough_words(words):
-    return len(words) < args.post_words_threshold
+def not_enough_words(word_count):
+    return word_count < args.post_words_threshold
 
-def not_enough_different_words(words):
-    return len(set(words)) < args.post_vocabulary_threshold
+def not_enough_different_words(distinct_word_count):
+    return distinct_word_count < args.post_vocabulary_threshold
 
 def is_bot(msg): 
-    return msg['author'] in botlist
+    return bots.is_bot(msg.get('author'))
+
+# The raw JSON of a body is never shorter than the decoded body. Rendering
+# markdown can only lengthen the text through expanded tabs and the newlines
+# placed around block elements (lists, quotes, headers), which is bounded by
+# 3 characters per tab, newline or '>' that could start such a block, plus a
+# trailing newline. Unicode escapes are counted as well since they may encode
+# any of these characters. Citation and URL removal only shorten the text.
+RAW_BODY_PATTERN = re.compile(r'"body":\s*"((?:[^"\\]|\\.)*)"')
+RAW_AUTHOR_PATTERN = re.compile(r'"author":\s*"([^"\\]*)"')
+RAW_STRUCTURE_TOKENS = ('\t', '\\n', '\\t', '\\u00', '>')
+RAW_LENGTH_MARGIN = 8
+
+def max_clean_length(raw_body):
+    structure = sum(raw_body.count(token) for token in RAW_STRUCTURE_TOKENS)
+    return len(raw_body) + 3 * structure + RAW_LENGTH_MARGIN
+
+def prefilter(line):
+    """Cheap check on the raw JSON line. Returns the reasons for which the
+    full pipeline would certainly reject it, or an empty set if the line has
+    to be parsed and analyzed."""
+    reasons = set()
+    bodies = RAW_BODY_PATTERN.findall(line)
+    if len(bodies) == 1 and max_clean_length(bodies[0]) < args.post_characters_threshold:
+        reasons.add('not enough characters')
+    authors = RAW_AUTHOR_PATTERN.findall(line)
+    if len(authors) == 1 and bots.is_bot(authors[0]):
+        reasons.add('is a bot')
+    return reasons
 
 printed_reasons = set()
 
-def analyze(msg): 
+def analyze(msg, word_count, distinct_word_count): 
     reasons = set()
-    words = msg['body_clean'].translate(
-        str.maketrans('', '', string.punctuation)).split()
     if not_enough_characters(msg):
         reasons.add('not enough characters')
-    if not_enough_words(words):
+    if not_enough_words(word_count):
         reasons.add('not enough words')
-    if not_enough_different_words(words):
+    if not_enough_different_words(distinct_word_count):
         reasons.add('not enough different words')
     if is_bot(msg):
         if 'bot' not in printed_reasons:
@@ -95,60 +153,331 @@ def analyze(msg):
         reasons.add('is a bot')
     return reasons
 
-def work(filename):
+def get_output_filename(filename):
     if not os.path.isdir(args.output_directory):
         os.makedirs(args.output_directory)
     split_dir = os.path.basename(os.path.dirname(filename))
     outdir = os.path.join(args.output_directory, split_dir)
     if not os.path.isdir(outdir):
         os.makedirs(outdir)
-    output_filename = os.path.join(outdir, os.path.basename(filename))
+    basename = strip_codec_extension(os.path.basename(filename))
+    if args.output_format == 'parquet':
+        return os.path.join(outdir, basename + columnar.EXTENSION)
+    return os.path.join(outdir, add_codec_extension(basename, args.compress_output))
+
+def identify_languages(messages, o_f, reasons):
+    try:
+        results = identifier.identify([msg['body_clean'] for msg in messages])
+    except Exception as e:
+        # the whole batch failed, count it for every comment
+        results = [e] * len(messages)
+    for msg, language_scores in zip(messages, results):
+        if isinstance(language_scores, Exception):
+            reasons["ERROR: " + str(language_scores)] += 1
+            continue
+        lang, score = language_scores[0]
+        if score > args.lang_detect_probability:
+            msg['language'] = lang
+            o_f.write(json.dumps(msg) + '\n')
+            reasons['success'] += 1
+        else:
+            reasons['language unclear'] += 1
+
+def filter_lines(lines, o_f):
+    reasons = defaultdict(int)
+    # comments that passed analyze() wait here until a batch is full
+    pending = []
+    for line in lines:
+        try: 
+            if args.prefilter:
+                msg_reasons = prefilter(line)
+                if msg_reasons:
+                    msg_reasons.add('prefiltered')
+                    for r in msg_reasons:
+                        reasons[r] += 1
+                    continue
+            msg = json.loads(line)
+            msg['body_clean'], word_count, distinct_word_count = clean(msg['body'])
+            msg_reasons = analyze(msg, word_count, distinct_word_count)
+
+            if 'not enough words' not in msg_reasons and 'not enough different words' in msg_reasons:
+                print('voc richness', msg)
+            # if 'not enough characters' not in msg_reasons and 'not enough words' in msg_reasons:
+            #     print('words', msg)
+
+            if not msg_reasons:
+                pending.append(msg)
+                if len(pending) >= args.lang_id_batch_size:
+                    batch, pending = pending, []
+                    identify_languages(batch, o_f, reasons)
+            for r in msg_reasons:
+                reasons[r] += 1
+        except Exception as e: 
+            reasons["ERROR: " + str(e)] += 1
+            continue
+    if pending:
+        identify_languages(pending, o_f, reasons)
+    return dict(reasons)
+
+def get_statistics_filename(filename):
+    stats_dirname = os.path.join(args.output_directory, 'statistics')
+    return os.path.join(
+        stats_dirname, 
+        strip_codec_extension(os.path.basename(filename)) + '.stats')
+
+def store_statistics(filename, reasons):
+    d = dict(reasons)
+    d['file'] = filename
+    stats_dirname = os.path.join(args.output_directory, 'statistics')
+    if not os.path.isdir(stats_dirname): 
+        os.makedirs(stats_dirname)
+    write_atomically(get_statistics_filename(filename), d)
+
+def hidden_filename(output_filename, suffix=''):
+    """Files that are still being written are hidden, so that the RC_*
+    patterns of the later stages do not pick them up."""
+    directory, basename = os.path.split(output_filename)
+    if suffix:
+        basename = strip_codec_extension(basename) + suffix
+    return os.path.join(directory, '.' + basename)
+
+def get_temporary_filename(output_filename):
+    """The output is written as JSON lines to this file first."""
+    if args.output_format == 'parquet':
+        return hidden_filename(output_filename, '.jsonl')
+    return hidden_filename(output_filename)
+
+def finish_output(temporary_filename, output_filename):
+    if args.output_format == 'parquet':
+        columnar_filename = hidden_filename(output_filename)
+        columnar.jsonl_to_columnar(temporary_filename, columnar_filename)
+        os.remove(temporary_filename)
+        temporary_filename = columnar_filename
+    os.replace(temporary_filename, output_filename)
+
+def sync(filename):
+    with open(filename, 'rb') as f:
+        os.fsync(f.fileno())
+
+def write_atomically(filename, data):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as o_f:
+        json.dump(data, o_f)
+        o_f.flush()
+        os.fsync(o_f.fileno())
+    os.replace(tmp_filename, filename)
+
+def load_checkpoint(filename, output_filename):
+    checkpoint_filename = hidden_filename(output_filename, '.checkpoint')
+    temporary_filename = get_temporary_filename(output_filename)
+    if os.path.isfile(checkpoint_filename) and os.path.isfile(temporary_filename):
+        with open(checkpoint_filename) as i_f:
+            checkpoint = json.load(i_f)
+        if checkpoint['file'] == filename:
+            # drop everything that was written after the checkpoint
+            os.truncate(temporary_filename, checkpoint['output_size'])
+            logging.info(f'resuming {filename} after {checkpoint["lines"]} lines')
+            return checkpoint
+    if os.path.isfile(temporary_filename):
+        os.remove(temporary_filename)
+    return {
+        'file': filename,
+        'lines': 0,
+        'position': 0,
+        'output_size': 0,
+        'reasons': {},
+    }
+
+def read_lines(filename, checkpoint):
+    """Yields the lines after the ones counted in the checkpoint and keeps
+    its line count and, for uncompressed files, its byte position up to
+    date. Compressed files cannot be seeked into, the lines that were already
+    processed are decompressed and skipped."""
+    if detect_codec(filename):
+        with open_input(filename) as i_f:
+            for line in itertools.islice(i_f, checkpoint['lines'], None):
+                checkpoint['lines'] += 1
+                yield line
+        return
+    with open(filename, 'rb') as i_f:
+        i_f.seek(checkpoint['position'])
+        for line in i_f:
+            checkpoint['lines'] += 1
+            checkpoint['position'] += len(line)
+            yield line.decode('utf-8')
+
+def work(filename):
+    output_filename = get_output_filename(filename)
     if os.path.isfile(output_filename): 
         logging.info(f'skipping existing files: {filename}/{output_filename}')
         return
-    with open(filename) as i_f, open(output_filename, 'w') as o_f:
-        reasons = defaultdict(int)
-        for line in i_f:
-            try: 
-                msg = json.loads(line)
-                msg['body_clean']= clean(msg['body'])
-                msg_reasons = analyze(msg)
-
-                if 'not enough words' not in msg_reasons and 'not enough different words' in msg_reasons:
-                    print('voc richness', msg)
-                # if 'not enough characters' not in msg_reasons and 'not enough words' in msg_reasons:
-                #     print('words', msg)
-
-                if not msg_reasons:
-                    language_scores = sorted(
-                        list(detect_langs(msg['body_clean'])),
-                        key=lambda x: x.prob, 
-                        reverse=True)
-                    scores = [x.prob for x in language_scores]
-                    langs = [x.lang for x in language_scores]
-                    if scores[0] > args.lang_detect_probability:
-                        msg['language'] = langs[0]
-                        o_f.write(json.dumps(msg) + '\n')
-                        msg_reasons.add('success')
-                    else:
-                        msg_reasons.add('language unclear')
-                for r in msg_reasons:
-                    reasons[r] += 1
-            except Exception as e: 
-                reasons["ERROR: " + str(e)] += 1
+    temporary_filename = get_temporary_filename(output_filename)
+    checkpoint_filename = hidden_filename(output_filename, '.checkpoint')
+    checkpoint = load_checkpoint(filename, output_filename)
+    reasons = defaultdict(int, checkpoint['reasons'])
+    lines = read_lines(filename, checkpoint)
+    while True:
+        processed = checkpoint['lines']
+        with open_output(temporary_filename, append=True) as o_f:
+            block_reasons = filter_lines(
+                itertools.islice(lines, args.checkpoint_interval), o_f)
+        if checkpoint['lines'] == processed:
+            break
+        for r, count in block_reasons.items():
+            reasons[r] += count
+        sync(temporary_filename)
+        checkpoint['output_size'] = os.path.getsize(temporary_filename)
+        checkpoint['reasons'] = dict(reasons)
+        write_atomically(checkpoint_filename, checkpoint)
+    # an existing output marks a file as done, so its statistics are stored
+    # before it
+    store_statistics(filename, reasons)
+    finish_output(temporary_filename, output_filename)
+    if os.path.isfile(checkpoint_filename):
+        os.remove(checkpoint_filename)
+
+def split_file(filename, chunk_size):
+    """Splits a file into byte ranges of about chunk_size bytes, each of
+    which ends directly after a newline."""
+    size = os.path.getsize(filename)
+    if not size:
+        # an empty file is a single empty chunk, so it gets an output too
+        return [(0, 0)]
+    boundaries = [0]
+    with open(filename, 'rb') as i_f:
+        while boundaries[-1] + chunk_size < size:
+            i_f.seek(boundaries[-1] + chunk_size - 1)
+            i_f.readline()
+            boundaries.append(i_f.tell())
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def read_chunk(filename, start, end):
+    if end is None:
+        with open_input(filename) as i_f:
+            yield from i_f
+        return
+    with open(filename, 'rb') as i_f:
+        i_f.seek(start)
+        position = start
+        while position < end:
+            line = i_f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+def part_filename(output_filename, part):
+    return hidden_filename(output_filename, f'.part{part:05d}')
+
+def work_chunk(job):
+    filename, output_filename, part, start, end = job
+    part_file = part_filename(output_filename, part)
+    # the statistics of a part are written after the part itself, so a part
+    # with statistics is complete and is reused after a restart
+    done_file = part_file + '.stats'
+    if os.path.isfile(done_file):
+        with open(done_file) as i_f:
+            done = json.load(i_f)
+        if (done['start'], done['end']) == (start, end):
+            return done['reasons']
+    with open(part_file, 'w') as o_f:
+        reasons = filter_lines(read_chunk(filename, start, end), o_f)
+    sync(part_file)
+    write_atomically(done_file, {'start': start, 'end': end, 'reasons': reasons})
+    return reasons
+
+def merge_chunks(filename, output_filename, chunk_reasons):
+    reasons = defaultdict(int)
+    temporary_filename = get_temporary_filename(output_filename)
+    with open_output(temporary_filename) as o_f:
+        for part, part_reasons in enumerate(chunk_reasons):
+            with open(part_filename(output_filename, part)) as i_f:
+                shutil.copyfileobj(i_f, o_f)
+            for r, count in part_reasons.items():
+                reasons[r] += count
+    store_statistics(filename, reasons)
+    finish_output(temporary_filename, output_filename)
+    for part in range(len(chunk_reasons)):
+        part_file = part_filename(output_filename, part)
+        os.remove(part_file)
+        os.remove(part_file + '.stats')
+
+def work_chunked(files):
+    chunk_size = args.chunk_size * 2 ** 20
+    jobs = []
+    for filename in files:
+        output_filename = get_output_filename(filename)
+        if os.path.isfile(output_filename): 
+            logging.info(f'skipping existing files: {filename}/{output_filename}')
+            continue
+        if detect_codec(filename):
+            logging.warning(f'cannot split compressed file {filename}, '
+                            'filtering it as a single chunk')
+            ranges = [(0, None)]
+        else:
+            ranges = split_file(filename, chunk_size)
+        for part, (start, end) in enumerate(ranges):
+            jobs.append((filename, output_filename, part, start, end))
+    logging.info(f'split {len(files)} files into {len(jobs)} chunks')
+
+    # imap returns the chunks in order, so each file can be merged as soon as
+    # its last chunk is done.
+    with mp.Pool(processes=args.jobs) as pool:
+        chunk_reasons = []
+        results = pool.imap(work_chunk, jobs)
+        for i, (job, reasons) in enumerate(tqdm.tqdm(zip(jobs, results), total=len(jobs))):
+            filename, output_filename = job[:2]
+            chunk_reasons.append(reasons)
+            if i + 1 == len(jobs) or jobs[i + 1][0] != filename:
+                merge_chunks(filename, output_filename, chunk_reasons)
+                chunk_reasons = []
+
+def output_keys(output_filename):
+    return comment_keys(json.loads(line) for line in columnar.read_json_lines(output_filename))
+
+def remove_comments(output_filename, keep):
+    temporary_filename = get_temporary_filename(output_filename)
+    with open_output(temporary_filename) as o_f:
+        for line, kept in zip(columnar.read_json_lines(output_filename), keep):
+            if kept:
+                o_f.write(line)
+    finish_output(temporary_filename, output_filename)
+
+def remove_duplicates(files):
+    """Removes the comments of the output files that occurred before in the
+    same or an earlier file, and counts them in the statistics. The keys of
+    the comments are computed in parallel, but checked in the order of the
+    files."""
+    outputs = {}
+    for filename in files:
+        output_filename = get_output_filename(filename)
+        if os.path.isfile(output_filename):
+            outputs.setdefault(output_filename, filename)
+    seen = KeySet()
+    removed = 0
+    with mp.Pool(processes=args.jobs) as pool:
+        results = pool.imap(output_keys, list(outputs))
+        for (output_filename, filename), keys in zip(tqdm.tqdm(outputs.items()), results):
+            new = seen.add(keys)
+            duplicates = int(len(new) - new.sum())
+            if not duplicates:
                 continue
+            remove_comments(output_filename, new)
+            with open(get_statistics_filename(filename)) as i_f:
+                reasons = json.load(i_f)
+            reasons['duplicate'] = reasons.get('duplicate', 0) + duplicates
+            reasons['success'] -= duplicates
+            write_atomically(get_statistics_filename(filename), reasons)
+            removed += duplicates
+    logging.info(f'removed {removed} duplicates, kept {len(seen)} comments')
 
-        d = dict(reasons)
-        d['file'] = filename
-        stats_dirname = os.path.join(args.output_directory, 'statistics')
-        if not os.path.isdir(stats_dirname): 
-            os.makedirs(stats_dirname)
-        stats_filename = os.path.join(
-            stats_dirname, 
-            os.path.basename(filename) + '.stats')
-        with open(stats_filename, 'w') as o_f:
-            json.dump(d, o_f)
-
-with mp.Pool(processes=args.jobs) as pool:
-    r = list(tqdm.tqdm(pool.imap(work, files), total=len(files)))
-    print('done')
+if args.chunk_size:
+    work_chunked(files)
+else:
+    with mp.Pool(processes=args.jobs) as pool:
+        r = list(tqdm.tqdm(pool.imap(work, files), total=len(files)))
+if args.dedupe:
+    remove_duplicates(files)
+print('done')
@@ -27,29 +27,58 @@ import json
 import pickle
 import os
 import glob
+import hashlib
 import numpy as np
 import logging
 logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s: %(message)s')
 import tempfile
 import datetime
+import shutil
+import itertools
+
+from columnar import (read_fields, read_located_fields, read_located_records,
+                      read_records)
+from buckets import (MAX_SPLIT_LEVEL, MEMORY_PER_BYTE, BucketWriter, bucket_directory,
+                     bucket_of, bucket_size, count_buckets, read_bucket)
+from duplicates import KeySet, comment_keys
+from group_index import BinaryIndex, is_binary_index, write_index
+from keyed_writer import ThresholdWriter
+from name_sets import NameSet, is_listable, read_names
+from packed_corpus import create_writer
+from parallel import map_tasks
+
+SPILL_DTYPE = np.dtype([('target', '<i4'), ('group', '<i4'), ('file', '<i4'), ('location', '<i8')])
+SPILL_BUFFER_SIZE = 1000000
+DEDUPE_BATCH_SIZE = 10000
+MAX_NAME_LENGTH = 255
 
 
 def find_overlap(index, limits):
-    target_field = index['target_field']
-    grouping_field = index['grouping_field']
-
     # e.g., all languages in the index
-    all_groups = set(index['data'].keys())
+    if isinstance(index, BinaryIndex):
+        target_field = index.target_field
+        grouping_field = index.grouping_field
+        all_groups = set(index.groups)
+    else:
+        target_field = index['target_field']
+        grouping_field = index['grouping_field']
+        all_groups = set(index['data'].keys())
     if not limits[grouping_field]:
         logging.warning(f'you are grouping by {grouping_field}, but you have not'
         ' restricted this field. There will probably be no overlap and you will'
         ' probably get an empty result.')
         groups = all_groups
-    elif limits[grouping_field] - all_groups:
-        logging.error(f'the requested grouping field values {limits[grouping_field] -all_groups} are not in the index')
-        exit()
     else:
-        groups = all_groups.intersection(limits[grouping_field])
+        groups = {group for group in all_groups if group in limits[grouping_field]}
+        if len(groups) < len(limits[grouping_field]):
+            if is_listable(limits[grouping_field]):
+                missing = set(limits[grouping_field]) - all_groups
+            else:
+                missing = f'{len(limits[grouping_field]) - len(groups)} of the requested values'
+            logging.error(f'the requested grouping field values {missing} are not in the index')
+            exit()
+    if exclusions[grouping_field]:
+        groups = {group for group in groups if group not in exclusions[grouping_field]}
 
 
     # now is, e.g., [de, en]
@@ -58,11 +87,18 @@ def find_overlap(index, limits):
     
     # now look for targets that are common in all found groups
     targets = set()
-    for group in groups:
-        if not targets:
-            targets = set(index['data'][group])
-        else:
-            targets = targets.intersection(set(index['data'][group]))
+    if isinstance(index, BinaryIndex):
+        targets = set(index.target_names(index.overlap(groups)))
+    else:
+        for group in groups:
+            if not targets:
+                targets = set(index['data'][group])
+            else:
+                targets = targets.intersection(set(index['data'][group]))
+    if limits[target_field]:
+        targets = {target for target in targets if target in limits[target_field]}
+    if exclusions[target_field]:
+        targets = {target for target in targets if target not in exclusions[target_field]}
 
     logging.debug(f'limiting targets to {targets}')
     return {
@@ -70,27 +106,131 @@ def find_overlap(index, limits):
         'target': targets
     }
 
-def find_posts(target_field, grouping_field, filenames, limits, c):
+def find_posts(target_field, grouping_field, filenames, limits, c, jobs=1, dedupe=False):
     result = defaultdict(lambda: defaultdict(list))
-    for filename in tqdm(filenames):
-        with open(filename) as i_f:
-            for line in i_f:
-                data = json.loads(line)
-                if len(data['body']) < c:
-                    continue
-                adding = True
-                for key in limits.keys():
-                    if not limits[key]:
-                        continue
-                    if data[key] not in limits[key]:
-                        adding = False
-                        break
-                if adding:
-                    post_target = data[target_field]
-                    post_group = data[grouping_field]
-                    result[post_target][post_group].append(data)
+    arguments = [(target_field, grouping_field, filename, limits, c) for filename in filenames]
+    seen = KeySet()
+    for file_posts in map_tasks(find_file_posts, arguments, jobs):
+        if dedupe:
+            file_posts = drop_duplicates(file_posts, seen)
+        for post_target, groups in file_posts.items():
+            for post_group, posts in groups.items():
+                result[post_target][post_group].extend(posts)
     return result
 
+def drop_duplicates(posts, seen):
+    """Removes the posts (in the layout of find_posts) that are in seen or
+    occur twice, and adds the others to seen."""
+    flat = [(target, group, post) for target, groups in posts.items()
+            for group, group_posts in groups.items() for post in group_posts]
+    new = seen.add(comment_keys(post for _, _, post in flat))
+    result = defaultdict(lambda: defaultdict(list))
+    for (target, group, post), is_new in zip(flat, new):
+        if is_new:
+            result[target][group].append(post)
+    return result
+
+def drop_duplicate_messages(messages, seen):
+    """Like drop_duplicates, for a stream of posts."""
+    messages = iter(messages)
+    while True:
+        batch = list(itertools.islice(messages, DEDUPE_BATCH_SIZE))
+        if not batch:
+            return
+        for msg, is_new in zip(batch, seen.add(comment_keys(batch))):
+            if is_new:
+                yield msg
+
+def post_predicate(limits, c):
+    """Returns the fields that decide whether a post is collected, and the
+    predicate for read_records. The limits, the exclusions and the excluded
+    ids are turned into a flat list of checks once, so they are not walked
+    again for every post."""
+    fields = ['body_length']
+    # (index of the value, names, whether the value must not be in them)
+    checks = []
+    for key, allowed in limits.items():
+        if allowed:
+            checks.append((len(fields), allowed, False))
+            fields.append(key)
+    for key, denied in exclusions.items():
+        if denied:
+            checks.append((len(fields), denied, True))
+            fields.append(key)
+    if excluded_ids:
+        checks.append((len(fields), excluded_ids, True))
+        fields.append('id')
+
+    def accept(values):
+        if values[0] < c:
+            return False
+        for index, names, negate in checks:
+            if (values[index] in names) == negate:
+                return False
+        return True
+
+    return fields, accept
+
+def find_file_posts(arguments):
+    target_field, grouping_field, filename, limits, c = arguments
+    result = defaultdict(lambda: defaultdict(list))
+    fields, accept = post_predicate(limits, c)
+    for data in read_records(filename, fields, accept):
+        post_target = data[target_field]
+        post_group = data[grouping_field]
+        result[post_target][post_group].append(data)
+    return {target: dict(groups) for target, groups in result.items()}
+
+def partition_file_posts(arguments):
+    """Writes the posts of a file that find_posts would collect to the
+    buckets of their targets."""
+    target_field, file_number, filename, limits, c, directory, n_buckets, buffer_size = arguments
+    fields, accept = post_predicate(limits, c)
+    with BucketWriter(directory, f'{file_number:05d}.jsonl', buffer_size) as writer:
+        for data in read_records(filename, fields, accept):
+            writer.write(bucket_of(data[target_field], n_buckets), json.dumps(data) + '\n')
+
+def partition_located_posts(located_posts, files, target_field, directory, n_buckets, buffer_size):
+    """Like materialize_posts, but writes the posts to the buckets of
+    their targets instead of keeping them in memory."""
+    wanted = defaultdict(list)
+    for groups in located_posts.values():
+        for locations in groups.values():
+            for file_number, location in locations:
+                wanted[file_number].append(location)
+    with BucketWriter(directory, 'posts.jsonl', buffer_size) as writer:
+        for file_number in tqdm(sorted(wanted)):
+            for location, data in read_located_records(files[file_number], sorted(wanted[file_number])):
+                writer.write(bucket_of(data[target_field], n_buckets), json.dumps(data) + '\n')
+
+def group_buckets(directory, n_buckets, target_field, grouping_field, memory_budget, level=0, dedupe=False):
+    """Yields the posts of one bucket after another, in the layout of
+    find_posts. Buckets that do not fit into the memory budget are split
+    again. All copies of a post are in the same bucket, in the order of the
+    input files, so duplicates can be removed per bucket."""
+    for bucket in tqdm(range(n_buckets), disable=level > 0):
+        size = bucket_size(directory, bucket)
+        if not size:
+            continue
+        if size * MEMORY_PER_BYTE > memory_budget:
+            if level < MAX_SPLIT_LEVEL:
+                split_directory = bucket_directory(directory, bucket) + '.split'
+                n_split = count_buckets(size, memory_budget)
+                with BucketWriter(split_directory, 'posts.jsonl', memory_budget // 2) as writer:
+                    for line in read_bucket(directory, bucket):
+                        writer.write(bucket_of(json.loads(line)[target_field], n_split, level + 1), line)
+                shutil.rmtree(bucket_directory(directory, bucket))
+                yield from group_buckets(split_directory, n_split, target_field, grouping_field, memory_budget, level + 1, dedupe)
+                continue
+            logging.warning(f'a bucket of {size} bytes does not fit into the memory budget')
+        result = defaultdict(lambda: defaultdict(list))
+        for line in read_bucket(directory, bucket):
+            data = json.loads(line)
+            result[data[target_field]][data[grouping_field]].append(data)
+        if dedupe:
+            result = drop_duplicates(result, KeySet())
+        yield result
+
 
 def filter_min_posts(data, m):
     for key in data.keys():
@@ -110,48 +250,33 @@ def check_output_dir(directory):
         logging.warning(f'The output directory {directory} is not empty. Storing to temporary directory {tmp} instead.')
         return tmp
 
-def create_non_border_corpus(target_field, limits, input_files, c, m):
-    values = defaultdict(list)
-    valids = set()
+def create_non_border_corpus(target_field, limits, input_files, c, m, memory_budget=None, dedupe=False):
     timestamp = datetime.datetime.now().strftime('%d-%m-%Y--%H-%M')
     output_directory = check_output_dir(f'{target_field}_{timestamp}')
     logging.info(limits)
-    authors = limits['author']
-    languages = limits['language']
-    subreddits = limits['subreddit']
-    for filename in tqdm(files):
-        with open(filename) as i_f:
-            for line in i_f:
-                msg = json.loads(line)
-                if len(msg['body']) < c:
-                    continue
-                if authors and msg['author'] not in authors:
-                    continue
-                if languages and msg['language'] not in languages:
-                    continue
-                if subreddits and msg['subreddit'] not in subreddits:
-                    continue
-                key = msg[target_field]
-                values[key].append(msg)
-                if len(values[key]) == m:
-                    flush(key, values[key], output_directory)
-                    valids.add(key)
-                    values[key] = []
-
-    # flush remaining buffers
-    if not valids:
+    fields, accept = post_predicate(limits, c)
+    # the posts of keys with less than m posts so far are spilled to disk
+    # beyond the memory budget
+    writer = ThresholdWriter(output_directory, m, pending_size=memory_budget)
+    seen = KeySet()
+    for filename in tqdm(input_files):
+        messages = read_records(filename, fields, accept)
+        if dedupe:
+            messages = drop_duplicate_messages(messages, seen)
+        for msg in messages:
+            writer.add(msg[target_field], json.dumps(msg) + '\n')
+
+    if not writer.close():
         logging.warning('No results left to store, exiting')
-    for key in valids:
-        flush(key, values[key], output_directory)
-
-def flush(key, values, output_directory):
-    outfile = os.path.join(output_directory, key + '.json')
-    with open(outfile, 'a') as o_f:
-        for v in values:
-            o_f.write(json.dumps(v) + '\n')
 
-def create_cross_border_corpus(target_field, grouping_field, limits, input_files, c, m, index_location):
-    index = get_index(target_field, grouping_field, input_files, limits, index_location)
+def create_cross_border_corpus(target_field, grouping_field, limits, input_files, c, m, index_location, single_pass=False, index_format='json', jobs=1, memory_budget=None, packed=False, dedupe=False):
+    if single_pass:
+        spill = tempfile.NamedTemporaryFile(dir=index_location, suffix='.spill')
+        index, targets, groups = scan_index_and_candidates(
+            target_field, grouping_field, input_files, limits, c, index_location, spill, index_format, jobs)
+        spill.flush()
+    else:
+        index = get_index(target_field, grouping_field, input_files, limits, index_location, index_format, jobs)
 
     overlap = find_overlap(index, limits)
     limits[target_field] = overlap['target']
@@ -159,7 +284,15 @@ def create_cross_border_corpus(target_field, grouping_field, limits, input_files
 
     logging.info(f'collecting posts from {len(overlap["target"])} {target_field}s')
 
-    posts = find_posts(target_field, grouping_field, input_files, limits, c)
+    if single_pass:
+        posts = collect_candidates(spill.name, targets, groups, overlap)
+        spill.close()
+    elif memory_budget:
+        create_partitioned_corpus(target_field, grouping_field, limits, input_files, c, m,
+                                  overlap, None, index_location, memory_budget, jobs, packed, dedupe)
+        return
+    else:
+        posts = find_posts(target_field, grouping_field, input_files, limits, c, jobs, dedupe)
     if not posts:
         logging.warning('no posts left! exiting...')
         exit()
@@ -175,87 +308,345 @@ def create_cross_border_corpus(target_field, grouping_field, limits, input_files
     if not posts:
         logging.warning('no posts left! exiting...')
         exit()
- 
-    limits_string = []
-    if limits['subreddit']:
-        limits_string += limits['subreddit']
-    if limits['language']:
-        limits_string += limits['language']
+
+    if single_pass and memory_budget:
+        create_partitioned_corpus(target_field, grouping_field, limits, input_files, c, m,
+                                  overlap, posts, index_location, memory_budget, jobs, packed, dedupe)
+        return
+    if single_pass:
+        logging.info(f'reading the posts of {len(posts)} {target_field}s')
+        posts = materialize_posts(posts, input_files)
+        if dedupe:
+            # the duplicates were counted for m so far
+            posts = drop_duplicates(posts, KeySet())
+            posts = filter_desired_groups(filter_min_posts(posts, m), overlap['group'])
+            if not posts:
+                logging.warning('no posts left! exiting...')
+                exit()
+
+    outdir = check_output_dir(output_directory_name(target_field, grouping_field, c, m))
+    writer = create_writer(outdir, packed)
+    store_result(posts, writer)
+    writer.close()
+
+def output_directory_name(target_field, grouping_field, c, m):
+    # the limits are named as they were given, the limits themselves may be
+    # hashed or replaced by the overlap by now
+    limits_string = limit_labels['subreddit'] + limit_labels['language']
     if limits_string: 
         limits_string = '_'.join(limits_string)
     timestamp = datetime.datetime.now().strftime('%d-%m-%Y--%H-%M') 
-    outdir = check_output_dir(f'{target_field}_{grouping_field}_{limits_string}_{m}_{c}_{timestamp}')
-    store_result(posts, outdir)
+    return f'{target_field}_{grouping_field}_{limits_string}_{m}_{c}_{timestamp}'
+
+def create_partitioned_corpus(target_field, grouping_field, limits, input_files, c, m, overlap, located_posts, index_location, memory_budget, jobs=1, packed=False, dedupe=False):
+    """Collects the posts like find_posts or materialize_posts (if their
+    locations are given), but partitions them by target into buckets on
+    disk. The buckets are filtered and stored one after another, so only
+    one of them has to fit into the memory budget."""
+    directory = tempfile.mkdtemp(dir=index_location, suffix='.buckets')
+    # the size of the input files bounds the size of the buckets, unless the
+    # input files are compressed, then the buckets are split again later
+    n_buckets = count_buckets(sum(os.path.getsize(f) for f in input_files), memory_budget)
+    buffer_size = memory_budget // (2 * jobs)
+    writer = None
+    stored = 0
+    try:
+        logging.info(f'partitioning posts into {n_buckets} buckets')
+        if located_posts is None:
+            arguments = [(target_field, file_number, filename, limits, c, directory, n_buckets, buffer_size)
+                         for file_number, filename in enumerate(input_files)]
+            for _ in map_tasks(partition_file_posts, arguments, jobs):
+                pass
+        else:
+            partition_located_posts(located_posts, input_files, target_field, directory, n_buckets, buffer_size)
+
+        logging.info('filtering and storing the posts bucket by bucket')
+        for posts in group_buckets(directory, n_buckets, target_field, grouping_field, memory_budget, dedupe=dedupe):
+            posts = filter_min_posts(posts, m)
+            posts = filter_desired_groups(posts, overlap['group'])
+            if not posts:
+                continue
+            if writer is None:
+                outdir = check_output_dir(output_directory_name(target_field, grouping_field, c, m))
+                writer = create_writer(outdir, packed)
+            store_result(posts, writer)
+            stored += len(posts)
+        if writer is not None:
+            writer.close()
+    finally:
+        shutil.rmtree(directory)
+    if not stored:
+        logging.warning('no posts left! exiting...')
+        exit()
+    logging.info(f'stored the posts of {stored} {target_field}s')
 
-def get_index(target_field, grouping_field, input_files, limits, index_location):
-    index_filename = os.path.join(index_location, f'{target_field}_{grouping_field}.json')
-    if os.path.isfile(index_filename):
+def get_index_filename(target_field, grouping_field, index_location, index_format):
+    extension = '.idx' if index_format == 'binary' else '.json'
+    return os.path.join(index_location, f'{target_field}_{grouping_field}{extension}')
+
+def load_index(index_filename):
+    if is_binary_index(index_filename):
+        return BinaryIndex(index_filename)
+    with open(index_filename) as i_f:
+        return json.load(i_f)
+
+def get_index(target_field, grouping_field, input_files, limits, index_location, index_format='json', jobs=1):
+    index_filename = get_index_filename(target_field, grouping_field, index_location, index_format)
+    if os.path.exists(index_filename):
         try:
-            with open(index_filename) as i_f:
-                index = json.load(i_f)
-                if 'target_field' in index and 'grouping_field' in index:
-                    stored_target, stored_grouping = index['target_field'], index['grouping_field']
-                else:
-                    raise Exception('index probably old')
- 
-                if target_field != stored_target or grouping_field != stored_grouping:
-                    logging.warning('incompatible index file given.')
-                    logging.warning(f'stored fields:  {stored_target}, {stored_grouping}')
-                    logging.warning(f'reqired fields: {target_field}, {grouping_field}' )
-                    logging.warning('calculating new index')
-                    return calculate_new_index(target_field, grouping_field, input_files, index_location)
-                else:
-                    logging.info(f'using index: {index_filename}')
-                    return index
+            index = load_index(index_filename)
+            if isinstance(index, BinaryIndex):
+                stored_target, stored_grouping, stored_files = index.target_field, index.grouping_field, index.files
+            elif 'target_field' in index and 'grouping_field' in index:
+                stored_target, stored_grouping, stored_files = index['target_field'], index['grouping_field'], index.get('files')
+            else:
+                raise Exception('index probably old')
+
+            if target_field != stored_target or grouping_field != stored_grouping:
+                logging.warning('incompatible index file given.')
+                logging.warning(f'stored fields:  {stored_target}, {stored_grouping}')
+                logging.warning(f'reqired fields: {target_field}, {grouping_field}' )
+                logging.warning('calculating new index')
+                return calculate_new_index(target_field, grouping_field, input_files, index_location, index_format, jobs)
+            elif stored_files != index_manifest(input_files):
+                logging.warning(f'index {index_filename} was built from other input files, updating it')
+                return calculate_new_index(target_field, grouping_field, input_files, index_location, index_format, jobs)
+            else:
+                logging.info(f'using index: {index_filename}')
+                return index
         except Exception as e:
             logging.warning(f'exception during parsing index file {index_filename}: {e}')
             logging.warning('calculating new index')
-            return calculate_new_index(target_field, grouping_field, input_files, index_location)
+            return calculate_new_index(target_field, grouping_field, input_files, index_location, index_format, jobs)
     else:
         logging.warning(f'could not find filename {index_filename}, calculating new index')
-        return calculate_new_index(target_field, grouping_field, input_files, index_location)
+        return calculate_new_index(target_field, grouping_field, input_files, index_location, index_format, jobs)
 
         
-def calculate_new_index(target_field, grouping_field, files, index_location):
-    index_filename = os.path.join(index_location, f'{target_field}_{grouping_field}.json')
+def file_signature(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def index_manifest(files):
+    return {os.path.abspath(f): file_signature(f) for f in files}
+
+def partial_index_filename(target_field, grouping_field, filename, index_location):
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(index_location, f'{target_field}_{grouping_field}', key + '.json')
+
+def load_partial_index(partial_filename, filename):
+    """Returns the index of a single input file, or None if it was not
+    stored yet, cannot be read or the file changed since."""
+    if not os.path.isfile(partial_filename):
+        return None
+    try:
+        with open(partial_filename) as i_f:
+            partial = json.load(i_f)
+        if partial['file'] != os.path.abspath(filename) or partial['signature'] != file_signature(filename):
+            return None
+        return dict(partial['data'])
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f'rebuilding the unreadable partial index {partial_filename}: {e}')
+        return None
+
+def store_partial_index(partial_filename, filename, signature, data):
+    directory = os.path.dirname(partial_filename)
+    os.makedirs(directory, exist_ok=True)
+    # written to a temporary file first, so a crash never leaves a partial
+    # index that looks complete
+    with open(partial_filename + '.tmp', 'w') as o_f:
+        json.dump({'file': os.path.abspath(filename), 'signature': signature, 'data': data}, o_f)
+    os.replace(partial_filename + '.tmp', partial_filename)
+
+def calculate_new_index(target_field, grouping_field, files, index_location, index_format='json', jobs=1):
+    """Merges the indices of the single input files. They are kept next to
+    the index and only recalculated for new or changed files."""
+    index_filename = get_index_filename(target_field, grouping_field, index_location, index_format)
     values = defaultdict(set)
-    unique_values = set()
+    reused = 0
     logging.info('starting work')
-    for filename in tqdm(files):
-        with open(filename) as i_f:
-            for line in i_f:
-                msg = json.loads(line)
-                target = msg[target_field]
-                group = msg[grouping_field]
-                values[group].add(target)
-                unique_values.add(target)
-    data = {k: list(v) for k,v in dict(values).items()}
+    arguments = [(target_field, grouping_field, filename, index_location) for filename in files]
+    for data, was_reused in map_tasks(index_file, arguments, jobs):
+        reused += was_reused
+        for group, targets in data.items():
+            values[group].update(targets)
+    logging.info(f'reused the index of {reused} of {len(files)} input files')
     payload = {
         'target_field': target_field,
         'grouping_field': grouping_field,
-        'data': data
+        'files': index_manifest(files),
+        'data': dict(values)
     }
-    store_index(payload, index_filename)
-    return payload
+    return store_index(payload, index_filename)
+
+def index_file(arguments):
+    """Returns the index of a single input file and whether it was reused."""
+    target_field, grouping_field, filename, index_location = arguments
+    partial_filename = partial_index_filename(target_field, grouping_field, filename, index_location)
+    data = load_partial_index(partial_filename, filename)
+    if data is not None:
+        return data, True
+    signature = file_signature(filename)
+    file_values = defaultdict(set)
+    for target, group in read_fields(filename, [target_field, grouping_field]):
+        file_values[group].add(target)
+    data = {k: list(v) for k,v in dict(file_values).items()}
+    store_partial_index(partial_filename, filename, signature, data)
+    return data, False
+
+def scan_index_and_candidates(target_field, grouping_field, files, limits, c, index_location, spill, index_format='json', jobs=1):
+    """Builds the same index as calculate_new_index and, in the same scan,
+    writes the target, group and location of every post that find_posts
+    could collect to the spill file. Targets and groups are interned, the
+    returned dicts map their names to the ids in the spill."""
+    index_filename = get_index_filename(target_field, grouping_field, index_location, index_format)
+    values = defaultdict(set)
+    targets = {}
+    groups = {}
+    logging.info('starting work')
+    arguments = [(target_field, grouping_field, file_number, filename, limits, c, index_location)
+                 for file_number, filename in enumerate(files)]
+    for data, file_targets, file_groups, part_filename in map_tasks(scan_file, arguments, jobs):
+        # the ids of every file are interned in the order of their first
+        # occurrence, so interning them again in the order of the files
+        # gives the same ids as a single scan over all files
+        target_ids = np.array([targets.setdefault(t, len(targets)) for t in file_targets], dtype=np.int32)
+        group_ids = np.array([groups.setdefault(g, len(groups)) for g in file_groups], dtype=np.int32)
+        if os.path.getsize(part_filename):
+            part = np.memmap(part_filename, dtype=SPILL_DTYPE, mode='r')
+            for start in range(0, len(part), SPILL_BUFFER_SIZE):
+                block = np.array(part[start:start + SPILL_BUFFER_SIZE])
+                block['target'] = target_ids[block['target']]
+                block['group'] = group_ids[block['group']]
+                block.tofile(spill)
+            del part
+        os.remove(part_filename)
+        for group, group_targets in data.items():
+            values[group].update(group_targets)
+    payload = {
+        'target_field': target_field,
+        'grouping_field': grouping_field,
+        'files': index_manifest(files),
+        'data': dict(values)
+    }
+    return store_index(payload, index_filename), targets, groups
+
+def scan_file(arguments):
+    """Indexes a single input file and spills its candidate posts to a
+    file of their own, with the targets and groups interned per file.
+    Returns the index, the interned targets and groups and the spill."""
+    target_field, grouping_field, file_number, filename, limits, c, index_location = arguments
+    targets = {}
+    groups = {}
+    # the target and grouping limits are replaced by the overlap later on
+    fields, accept = post_predicate(
+        {key: value for key, value in limits.items() if key not in (target_field, grouping_field)}, c)
+    buffer = []
+    signature = file_signature(filename)
+    file_values = defaultdict(set)
+    part_handle, part_filename = tempfile.mkstemp(dir=index_location, suffix='.spill')
+    with os.fdopen(part_handle, 'wb') as part:
+        for location, (target, group, *values) in read_located_fields(filename, [target_field, grouping_field] + fields):
+            file_values[group].add(target)
+            if not accept(values):
+                continue
+            buffer.append((targets.setdefault(target, len(targets)),
+                           groups.setdefault(group, len(groups)),
+                           file_number, location))
+            if len(buffer) >= SPILL_BUFFER_SIZE:
+                np.array(buffer, dtype=SPILL_DTYPE).tofile(part)
+                buffer = []
+        if buffer:
+            np.array(buffer, dtype=SPILL_DTYPE).tofile(part)
+    data = {k: list(v) for k,v in dict(file_values).items()}
+    store_partial_index(
+        partial_index_filename(target_field, grouping_field, filename, index_location),
+        filename, signature, data)
+    return data, list(targets), list(groups), part_filename
+
+def collect_candidates(spill_filename, targets, groups, overlap):
+    """Reads the spilled posts of the overlapping targets and groups back,
+    as lists of (file number, location) in the layout of find_posts."""
+    result = defaultdict(lambda: defaultdict(list))
+    if not os.path.getsize(spill_filename):
+        return result
+    spill = np.memmap(spill_filename, dtype=SPILL_DTYPE, mode='r')
+    target_ids = np.array([targets[t] for t in overlap['target'] if t in targets], dtype=np.int32)
+    group_ids = np.array([groups[g] for g in overlap['group'] if g in groups], dtype=np.int32)
+    selected = np.nonzero(np.isin(spill['target'], target_ids) & np.isin(spill['group'], group_ids))[0]
+    target_names = list(targets)
+    group_names = list(groups)
+    for target, group, file_number, location in spill[selected].tolist():
+        result[target_names[target]][group_names[group]].append((file_number, location))
+    return result
+
+def materialize_posts(located_posts, files):
+    """Replaces the (file number, location) pairs by the posts, reading each
+    file only up to its last needed post."""
+    wanted = defaultdict(list)
+    for groups in located_posts.values():
+        for locations in groups.values():
+            for file_number, location in locations:
+                wanted[file_number].append(location)
+    records = {}
+    for file_number in tqdm(sorted(wanted)):
+        for location, record in read_located_records(files[file_number], sorted(wanted[file_number])):
+            records[file_number, location] = record
+    return {target: {group: [records[x] for x in locations] for group, locations in groups.items()}
+            for target, groups in located_posts.items()}
 
 def store_index(index, index_filename):
+    """Stores the index in the format given by the filename and returns it
+    as it is used afterwards."""
     logging.info('storing index to %s' % index_filename)
+    if is_binary_index(index_filename):
+        write_index(index_filename, index['target_field'], index['grouping_field'],
+                    index['files'], index['data'])
+        return BinaryIndex(index_filename)
+    index['data'] = {k: list(v) for k,v in index['data'].items()}
     with open(index_filename, 'w') as o_f:
         json.dump(index, o_f)
-
-def store_result(data, output_dir):
+    return index
+
+def load_near_duplicates(filename, action):
+    """Returns the ids of the comments to leave out of the clusters found by
+    near_duplicates.py: all of them, or all but the first of every cluster."""
+    excluded = set()
+    with open(filename) as i_f:
+        for line in i_f:
+            member = json.loads(line)
+            if action == 'drop' or member['id'] != member['cluster']:
+                excluded.add(member['id'])
+    return frozenset(excluded)
+
+def name_limit(names, filename, allowlist=True):
+    """The names of a comma separated option and of a file, or None if
+    neither is given."""
+    if not names and not filename:
+        return None
+    values = names.split(',') if names else []
+    if filename:
+        values += read_names(filename)
+    if allowlist and not values:
+        parser.error(f'the allowlist {filename} does not contain any names')
+    return NameSet(values)
+
+def limit_label(names, filename):
+    """The values of a limit for the output directory name: the sorted
+    values of the option, and the number of names and a short hash of the
+    file."""
+    label = sorted(names.split(',')) if names else []
+    if filename:
+        with open(filename, 'rb') as i_f:
+            digest = hashlib.sha1(i_f.read()).hexdigest()[:8]
+        label.append(f'{len(read_names(filename))}-{digest}')
+    return label
+
+def store_result(data, writer):
     for i, author in enumerate(list(data.keys())):
-        author_dir = os.path.join(output_dir, author)
-        if not os.path.isdir(author_dir):
-            os.mkdir(author_dir)
         for lang in data[author].keys():
-            lang_dir = os.path.join(author_dir, lang)
-            if not os.path.isdir(lang_dir):
-                os.mkdir(lang_dir)
             for j, post in enumerate(data[author][lang]):
-                file_name = os.path.join(lang_dir, '%06d.json' % j)
-                with open(file_name, 'w') as o_f:
-                    o_f.write(json.dumps(post))
+                writer.write(author, lang, '%06d.json' % j, json.dumps(post), len(post['body']))
 
 
 parser = argparse.ArgumentParser(description="Groups Reddit comments by specified parameters")
@@ -263,39 +654,69 @@ parser.add_argument('-i', '--input-pattern', required=True, help='glob pattern f
 parser.add_argument('-t', '--target-field', choices=['subreddit', 'author', 'language'], required=True, help='which field should be used for a target')
 parser.add_argument('-g', '--grouping-field', choices=['subreddit', 'author', 'language'], required=False, help='which field should be used for grouping the comments?')
 parser.add_argument('-a', '--authors', default=None, help='which authors to use')
+parser.add_argument('--authors-file', default=None, help='file with more authors to use, one per line')
+parser.add_argument('--exclude-authors-file', default=None, help='file with authors to leave out, one per line')
 parser.add_argument('-l', '--languages', default=None, help='which languages to use')
 parser.add_argument('-s', '--subreddits', default=None, help='which subreddits to use')
+parser.add_argument('--subreddits-file', default=None, help='file with more subreddits to use, one per line')
+parser.add_argument('--exclude-subreddits-file', default=None, help='file with subreddits to leave out, one per line')
 parser.add_argument('-m', default=1, type=int, help='How many documents must be present in each group per target')
 parser.add_argument('-c', default=1000, type=int, help='min. length of remaining documents')
 parser.add_argument('-idx', '--index-directory-location', default=os.path.expanduser('~'), help='Where to store intermediate index files')
+parser.add_argument('--index-format', choices=['json', 'binary'], default='json', help='store the index as JSON or in a binary, memory-mapped format that loads and intersects faster for many targets')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes that scan the input files')
+parser.add_argument('--memory-budget', type=int, default=None, help='group the posts in hash partitioned buckets on disk (or, without grouping field, spill the posts of targets with less than m posts to disk), so that grouping needs about this much memory (in MB)')
+parser.add_argument('--packed', action='store_true', help='store the corpus packed into a few shard files with an index instead of one file per post')
+parser.add_argument('--near-duplicates', default=None, help='clusters of near-duplicate comments found by near_duplicates.py')
+parser.add_argument('--near-duplicate-action', choices=['dedupe', 'drop'], default='dedupe', help='keep only the first comment of every near-duplicate cluster, or drop the clusters completely [dedupe]')
+parser.add_argument('--dedupe', action='store_true', help='leave out exact duplicates (same id and body_clean) of posts in the same or an earlier input file')
+parser.add_argument('--single-pass', action='store_true', help='build the index and collect the locations of candidate posts in one scan, then only read the posts that end up in the corpus. Always rebuilds the index')
 
 args = parser.parse_args()
 
 files = sorted(glob.glob(args.input_pattern))
 
-authors = None
-if args.authors:
-    authors = set(args.authors.split(','))
 languages = None
 if args.languages:
     languages = set(args.languages.split(','))
-subreddits = None
-if args.subreddits:
-    subreddits = set(args.subreddits.split(','))
 
 limits = {
-    'author': authors,
+    'author': name_limit(args.authors, args.authors_file),
     'language': languages,
-    'subreddit': subreddits
+    'subreddit': name_limit(args.subreddits, args.subreddits_file)
+}
+
+# the processes that scan the input files are forked with these exclusions
+# and ids
+exclusions = {
+    'author': name_limit(None, args.exclude_authors_file, allowlist=False),
+    'language': None,
+    'subreddit': name_limit(None, args.exclude_subreddits_file, allowlist=False)
+}
+limit_labels = {
+    'language': limit_label(args.languages, None),
+    'subreddit': limit_label(args.subreddits, args.subreddits_file)
 }
+excluded_ids = frozenset()
+if args.near_duplicates:
+    excluded_ids = load_near_duplicates(args.near_duplicates, args.near_duplicate_action)
+    logging.info(f'leaving out {len(excluded_ids)} near-duplicate comments')
+
+memory_budget = None
+if args.memory_budget:
+    memory_budget = args.memory_budget * 2 ** 20
 
 if args.target_field == args.grouping_field:
     logging.error('please provide different fields for target and grouping')
     exit()
 
+# the output directory is only created after all the grouping work
+if args.grouping_field and len(output_directory_name(args.target_field, args.grouping_field, args.c, args.m)) > MAX_NAME_LENGTH:
+    parser.error('the output directory name gets too long, pass the subreddits or languages with a file')
+
 if args.grouping_field:
     logging.info(f'grouping by {args.grouping_field} for every {args.target_field}')
-    create_cross_border_corpus(args.target_field, args.grouping_field, limits, files, args.c, args.m, args.index_directory_location)
+    create_cross_border_corpus(args.target_field, args.grouping_field, limits, files, args.c, args.m, args.index_directory_location, args.single_pass, args.index_format, args.jobs, memory_budget, args.packed, args.dedupe)
 else:
     logging.info('not grouping')
-    create_non_border_corpus(args.target_field, limits, files, args.c, args.m)
+    create_non_border_corpus(args.target_field, limits, files, args.c, args.m, memory_budget, args.dedupe)
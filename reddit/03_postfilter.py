@@ -15,17 +15,19 @@
 # along with this program.    If not, see <https://www.gnu.org/licenses/>.
 
 
-from collections import defaultdict
-from tqdm import tqdm, trange
+from bisect import bisect_left, bisect_right
 import argparse
-import json
 import logging
 import os
-import pathlib
+
+from packed_corpus import PackedCorpus, create_links, create_writer, open_corpus
+from parallel import map_tasks
 
 logging.basicConfig(level='INFO', 
                     format='%(asctime)s %(levelname)s: %(message)s')
 
+AUTHORS_PER_TASK = 100
+
 parser = argparse.ArgumentParser(
         description='Makes a stricter version of a generated Corpus by '
                     're-setting c and m values.')
@@ -34,11 +36,11 @@ parser.add_argument(
         '-i', '--input-directory', required=True, 
         help='Input directory')
 parser.add_argument(
-        '-m', required=True, type=int, 
+        '-m', type=int, 
         help='How many documents must be present in each group per target')
 
 parser.add_argument(
-        '-c', required=True, type=int, 
+        '-c', type=int, 
         help='min. length of remaining documents')
 parser.add_argument(
         '--c-offset', type=int, required=False, default=None,
@@ -49,71 +51,126 @@ parser.add_argument(
 parser.add_argument(
         '--steps', type=int, required=False, default=1,
         help='How many steps should be genererated [1]')
+parser.add_argument(
+        '--m-values', default=None,
+        help='grid mode: comma separated m values, combined with every '
+             'range of --c-ranges [None]')
+parser.add_argument(
+        '--c-ranges', default=None,
+        help='grid mode: comma separated c values or c:c_max ranges [None]')
 parser.add_argument('-o', '--output-directory', required=True, 
         help='Output directory')
+parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of processes that select and link the posts [1]')
 
 args = parser.parse_args()
-authors = sorted(os.listdir(args.input_directory))
-ignored_authors = set()
-
-if args.steps > 1 and args.c_step_size is None:
-    raise ValueError(f'please provide a c_step_size for more than 1 steps')
-
-if args.steps > 1 and args.c_step_size is not None and args.c_offset > args.c_step_size:
-    raise ValueError(f'your steps size ({args.c_step_size}) cant be larger '
-                     f'than your c_offset ({args.c_offset}), or your corpora '
-                     f'will have duplicate posts')
-
-post_map = defaultdict(dict)
+grid = args.m_values is not None or args.c_ranges is not None
+if grid and (args.m_values is None or args.c_ranges is None):
+    parser.error('grid mode needs both --m-values and --c-ranges')
+if not grid and (args.m is None or args.c is None):
+    parser.error('-m and -c are required without grid mode')
+corpus = open_corpus(args.input_directory)
+packed = isinstance(corpus, PackedCorpus)
 
-for step in trange(args.steps, desc='steps'):
-    c = args.c + step * args.c_step_size
-    c_max = None
-    if args.c_offset is not None:
-        c_max = c + args.c_offset
 
-    output_name = f'{args.m}_{c}'
+def output_directory_name(m, c, c_max):
+    output_name = f'{m}_{c}'
     if c_max is not None:
         output_name += f'_{c_max}'
-    indir = pathlib.Path(args.input_directory)
-    if not os.path.isdir(args.output_directory): 
-        os.makedirs(args.output_directory)
-    output_directory = os.path.join(args.output_directory, output_name)
-
-    for author in tqdm(authors, desc='authors', leave=False):
-        author_dir = os.path.join(args.input_directory, author)
-        categories = sorted(os.listdir(author_dir))
-        good = defaultdict(list)
-        bad = defaultdict(list)
-        for category in categories:
-            category_dir = os.path.join(author_dir, category)
-            posts = sorted(os.listdir(category_dir))
-
-            for post in posts:
-                src = os.path.join(category_dir, post)
-                with open(src) as i_f:
-                    js = json.load(i_f)
-                    size = len(js['body'])
-                    if c_max is not None and size > c_max: 
-                        bad[category].append(post)
-                    elif size < c:
-                        bad[category].append(post)
-                    else:
-                        good[category].append(post)
-
-            if len(good[category]) < args.m:
-                ignored_authors.add(author)
-
-        if author not in ignored_authors:
-            for category in categories:
-                outdir = os.path.join(output_directory, author, category)
-                os.makedirs(outdir)
-                for post in good[category]:
-
-                    src_dir_abs = os.path.join(author_dir, category)
-                    src_dir_rel = os.path.relpath(src_dir_abs, outdir)
-
-                    src_file = os.path.join(src_dir_rel, post)
-                    out_file = os.path.join(outdir, post)
-
-                    os.symlink(src_file, out_file)
+    return os.path.join(args.output_directory, output_name)
+
+
+# every cell is an (m, c, c_max, output directory) tuple
+cells = []
+if grid:
+    for c_range in args.c_ranges.split(','):
+        c, _, c_max = c_range.partition(':')
+        c = int(c)
+        c_max = int(c_max) if c_max else None
+        for m in args.m_values.split(','):
+            m = int(m)
+            cells.append((m, c, c_max, output_directory_name(m, c, c_max)))
+else:
+    if args.steps > 1 and args.c_step_size is None:
+        raise ValueError('please provide a c_step_size for more than 1 steps')
+
+    if args.steps > 1 and args.c_step_size is not None and args.c_offset > args.c_step_size:
+        raise ValueError(f'your steps size ({args.c_step_size}) cant be larger '
+                         f'than your c_offset ({args.c_offset}), or your corpora '
+                         f'will have duplicate posts')
+
+    for step in range(args.steps):
+        c = args.c + step * args.c_step_size
+        c_max = None
+        if args.c_offset is not None:
+            c_max = c + args.c_offset
+        cells.append((args.m, c, c_max, output_directory_name(args.m, c, c_max)))
+if not os.path.isdir(args.output_directory): 
+    os.makedirs(args.output_directory)
+
+# all cells are decided in one visit of every author, with the lengths from
+# the length manifest (or the index of a packed corpus), so the posts
+# themselves are never read. The output links to the posts of the input,
+# with symlinks or, for a packed corpus, with an index referring to its
+# shards.
+def select_posts(author):
+    """Returns the posts of an author that are kept in every cell, as
+    (category, posts) pairs per output directory."""
+    # the posts of every category sorted by length, so the posts between c
+    # and c_max are found by binary search
+    lengths = {}
+    for category in corpus.groups(author):
+        pairs = sorted((corpus.body_length(author, category, post), post)
+                       for post in corpus.posts(author, category))
+        lengths[category] = ([size for size, _ in pairs], [post for _, post in pairs])
+    selected = {}
+    for m, c, c_max, output_directory in cells:
+        ranges = {}
+        for category, (sizes, posts) in lengths.items():
+            start = bisect_left(sizes, c)
+            end = len(sizes) if c_max is None else bisect_right(sizes, c_max)
+            ranges[category] = (start, end)
+        if any(end - start < m for start, end in ranges.values()):
+            if grid:
+                continue
+            # an author that is ignored in a step is ignored in all later
+            # steps as well
+            break
+        selected[output_directory] = [(category, sorted(lengths[category][1][start:end]))
+                                      for category, (start, end) in ranges.items()]
+    return selected
+
+
+def process_authors(authors):
+    """Selects the posts of the authors and creates the symlinks for the
+    directory layout. Runs in the worker processes."""
+    result = []
+    for author in authors:
+        selected = select_posts(author)
+        if not packed:
+            for output_directory, categories in selected.items():
+                for category, posts in categories:
+                    create_links(corpus, output_directory, author, category, posts)
+        result.append((author, selected))
+    return result
+
+
+corpus.load_lengths()
+authors = corpus.targets()
+chunks = [authors[i:i + AUTHORS_PER_TASK] for i in range(0, len(authors), AUTHORS_PER_TASK)]
+writers = {}
+for result in map_tasks(process_authors, chunks, args.jobs, desc='authors'):
+    for author, selected in result:
+        for output_directory, categories in selected.items():
+            if output_directory not in writers:
+                writers[output_directory] = create_writer(output_directory, packed)
+            writer = writers[output_directory]
+            for category, posts in categories:
+                if packed:
+                    writer.link(corpus, author, category, posts)
+                else:
+                    writer.record_links(corpus, author, category, posts)
+
+for writer in writers.values():
+    writer.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the fused cleaning and tokenization of 01_filter.py with the
+separate passes it replaced, on the markdown-free text of a sample of
+comments. Both must return the same text and word counts for every comment.
+"""
+
+import argparse
+import itertools
+import json
+import re
+import string
+import time
+
+import hoep as h
+from bs4 import BeautifulSoup as BS
+
+from cleaning import clean_and_tokenize
+from compression import open_input
+
+parser = argparse.ArgumentParser(description='Benchmarks citation/URL removal and tokenization on a sample of Reddit comments.')
+parser.add_argument('-i', '--input-file', required=True, help='RC_20XX file to take the sample from')
+parser.add_argument('-n', '--sample-size', type=int, default=10000, help='number of comments to use [10000]')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='timing repetitions, the best one is reported [3]')
+args = parser.parse_args()
+
+
+def separate_passes(text):
+    lines = text.split('\n')
+    text = '\n'.join([x for x in lines if not x.startswith('>')])
+    text = re.sub('\\S*https?:\\/\\/\\S+', '<URL>', text, flags=re.MULTILINE)
+    words = text.translate(str.maketrans('', '', string.punctuation)).split()
+    return text, len(words), len(set(words))
+
+
+def best_time(function, texts):
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+with open_input(args.input_file) as i_f:
+    texts = [BS(h.render(json.loads(line)['body']), features='lxml').get_text()
+             for line in itertools.islice(i_f, args.sample_size)]
+
+mismatches = [t for t in texts if separate_passes(t) != clean_and_tokenize(t)]
+for text in mismatches[:10]:
+    print(f'MISMATCH: {text!r}')
+
+separate_time = best_time(separate_passes, texts)
+fused_time = best_time(clean_and_tokenize, texts)
+
+print(f'COMMENTS:     {len(texts):12d}')
+print(f'MISMATCHES:   {len(mismatches):12d}')
+print(f'SEPARATE:     {separate_time:12.3f}s')
+print(f'FUSED:        {fused_time:12.3f}s')
+print(f'SPEEDUP:      {separate_time / fused_time:12.2f}x')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the two markdown engines of 01_filter.py on a sample of comments.
+Every comment of the sample is a golden test case: the fast engine must
+produce exactly the text of the hoep/BeautifulSoup chain.
+"""
+
+import argparse
+import itertools
+import json
+import time
+
+import hoep as h
+from bs4 import BeautifulSoup as BS
+
+from compression import open_input
+from markdown_text import markdown_to_text, rendered_to_text
+
+parser = argparse.ArgumentParser(description='Benchmarks markdown removal on a sample of Reddit comments.')
+parser.add_argument('-i', '--input-file', required=True, help='RC_20XX file to take the sample from')
+parser.add_argument('-n', '--sample-size', type=int, default=10000, help='number of comments to use [10000]')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='timing repetitions, the best one is reported [3]')
+args = parser.parse_args()
+
+
+def hoep_engine(text):
+    html = h.render(text)
+    return BS(html, features='lxml').get_text()
+
+
+def fast_engine(text):
+    plain = markdown_to_text(text)
+    if plain is not None:
+        return plain
+    html = h.render(text)
+    plain = rendered_to_text(text, html)
+    if plain is not None:
+        return plain
+    return BS(html, features='lxml').get_text()
+
+
+def best_time(engine, bodies):
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            engine(body)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+with open_input(args.input_file) as i_f:
+    bodies = [json.loads(line)['body'] for line in itertools.islice(i_f, args.sample_size)]
+
+covered = 0
+tokenized = 0
+mismatches = []
+for body in bodies:
+    plain = markdown_to_text(body)
+    if plain is not None:
+        covered += 1
+    else:
+        plain = rendered_to_text(body, h.render(body))
+        if plain is None:
+            continue
+        tokenized += 1
+    expected = hoep_engine(body)
+    if plain != expected:
+        mismatches.append((body, plain, expected))
+
+for body, plain, expected in mismatches[:10]:
+    print(f'MISMATCH: {body!r}\n    fast: {plain!r}\n    hoep: {expected!r}')
+
+hoep_time = best_time(hoep_engine, bodies)
+fast_time = best_time(fast_engine, bodies)
+
+print(f'COMMENTS:     {len(bodies):12d}')
+print(f'DIRECT:       {covered:12d} ({covered / max(len(bodies), 1):.1%})')
+print(f'TOKENIZED:    {tokenized:12d} ({tokenized / max(len(bodies), 1):.1%})')
+print(f'MISMATCHES:   {len(mismatches):12d}')
+print(f'HOEP:         {hoep_time:12.3f}s')
+print(f'FAST:         {fast_time:12.3f}s')
+print(f'SPEEDUP:      {hoep_time / fast_time:12.2f}x')
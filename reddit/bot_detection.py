@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Detection of bot accounts by their names.
+
+Exact names, the list in bots.py and those of optional extra files, are
+looked up in a frozen set. Name patterns are compiled into a single regular
+expression, so every name is checked against all of them in one match.
+
+An extra bot list has one entry per line. Entries containing * or ? are
+patterns where * matches any run of characters and ? a single one, entries
+starting with re: are regular expressions, and all others are exact names.
+Empty lines and lines starting with # are ignored.
+"""
+
+import re
+
+from bots import botlist
+
+REGEX_PREFIX = 're:'
+
+
+def glob_to_regex(pattern):
+    """Translates a pattern where only * and ? are special to a regular
+    expression."""
+    return ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern)
+
+
+def is_pattern(entry):
+    return entry.startswith(REGEX_PREFIX) or '*' in entry or '?' in entry
+
+
+def read_bot_list(filename):
+    with open(filename) as i_f:
+        entries = [line.strip() for line in i_f]
+    return [e for e in entries if e and not e.startswith('#')]
+
+
+class BotDetector:
+
+    def __init__(self, names=(), patterns=(), ignore_case=False):
+        self.ignore_case = ignore_case
+        self.names = frozenset(self.normalize(n) for n in names)
+        regexes = [p[len(REGEX_PREFIX):] if p.startswith(REGEX_PREFIX) else glob_to_regex(p)
+                   for p in patterns]
+        self.pattern = None
+        if regexes:
+            flags = re.IGNORECASE if ignore_case else 0
+            self.pattern = re.compile('|'.join(f'(?:{r})' for r in regexes), flags)
+
+    def normalize(self, name):
+        return name.casefold() if self.ignore_case else name
+
+    def is_bot(self, name):
+        # deleted comments and some old dumps have no author name
+        if not isinstance(name, str):
+            return False
+        if self.normalize(name) in self.names:
+            return True
+        return self.pattern is not None and self.pattern.fullmatch(name) is not None
+
+
+def create_detector(bot_list_files=(), patterns=(), ignore_case=False):
+    """A detector for the names in bots.py, the entries of the given files
+    and the given patterns."""
+    entries = list(botlist)
+    for filename in bot_list_files:
+        entries.extend(read_bot_list(filename))
+    entries.extend(patterns)
+    names = [e for e in entries if not is_pattern(e)]
+    return BotDetector(names, [e for e in entries if is_pattern(e)], ignore_case)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hash partitioning of lines into on-disk buckets, for grouping more posts
+than fit into memory.
+
+The lines of a bucket are stored in a directory of their own, one file per
+writer, so that several processes can fill the buckets at the same time.
+Reading a bucket returns the lines of all writers in the order of their file
+names, and the lines of each writer in the order they were written.
+"""
+
+import os
+
+from sketches import hash64
+
+# a bucket is grouped in memory if its size on disk times this factor fits
+# into the memory budget, parsed posts take several times their JSON size
+MEMORY_PER_BYTE = 4
+MAX_BUCKETS = 1024
+# a bucket that is too large is split at most this often, a single target
+# with too many posts cannot be split anyway
+MAX_SPLIT_LEVEL = 2
+
+
+def bucket_of(key, n_buckets, level=0):
+    """A hash of the key that is the same in every process. Buckets that are
+    split again use another level, which gives an independent hash. (A CRC
+    would not: for keys of the same length, the CRCs of two levels differ by
+    a constant, so a split bucket would keep most of its keys together.)"""
+    return hash64(f'{level}:{key}') % n_buckets
+
+
+def count_buckets(size, memory_budget):
+    """The number of buckets needed to group size bytes of lines within the
+    memory budget."""
+    return max(1, min(MAX_BUCKETS, -(-size * MEMORY_PER_BYTE // memory_budget)))
+
+
+def bucket_directory(directory, bucket):
+    return os.path.join(directory, f'{bucket:05d}')
+
+
+def bucket_files(directory, bucket):
+    path = bucket_directory(directory, bucket)
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+
+
+def read_bucket(directory, bucket):
+    for filename in bucket_files(directory, bucket):
+        with open(filename) as i_f:
+            yield from i_f
+
+
+def bucket_size(directory, bucket):
+    return sum(os.path.getsize(f) for f in bucket_files(directory, bucket))
+
+
+class BucketWriter:
+    """Appends lines to the buckets in a directory, keeping up to
+    buffer_size characters in memory before writing them out."""
+
+    def __init__(self, directory, name, buffer_size):
+        self.directory = directory
+        self.name = name
+        self.buffer_size = buffer_size
+        self.buffers = {}
+        self.buffered = 0
+
+    def write(self, bucket, line):
+        self.buffers.setdefault(bucket, []).append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for bucket, lines in self.buffers.items():
+            path = bucket_directory(self.directory, bucket)
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, self.name), 'a') as o_f:
+                o_f.writelines(lines)
+        self.buffers = {}
+        self.buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
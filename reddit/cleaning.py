@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""
+Removal of citations and URLs from the plain text of a comment, fused with
+the word tokenization that 01_filter.py uses for its thresholds.
+"""
+
+import re
+import string
+
+URL_PATTERN = re.compile(r'\S*https?:\/\/\S+', flags=re.MULTILINE)
+URL_REPLACEMENT = '<URL>'
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+
+def remove_urls(text):
+    return URL_PATTERN.sub(URL_REPLACEMENT, text)
+
+
+def clean_and_tokenize(text):
+    """Removes citations and URLs from a text and counts its words.
+
+    Returns the cleaned text, the number of words and the number of distinct
+    words, where words are the whitespace separated tokens after removing
+    all punctuation. The text is processed in a single pass over its lines:
+    neither a citation nor a URL spans a line break, so every line is
+    dropped, cleaned and tokenized on its own.
+    """
+    lines = []
+    words = []
+    for line in text.split('\n'):
+        if line.startswith('>'):
+            continue
+        if '://' in line:
+            line = remove_urls(line)
+        lines.append(line)
+        words += line.translate(PUNCTUATION_TABLE).split()
+    return '\n'.join(lines), len(words), len(set(words))
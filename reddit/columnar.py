@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar (Parquet) storage of filtered comments.
+
+Besides the complete JSON record of a comment, a columnar file stores the
+fields that the grouping and statistics stages look at in separate columns,
+so that they can be read without loading and parsing the comment bodies.
+The readers in this module accept both columnar and JSON lines files.
+"""
+
+import itertools
+import json
+
+from compression import detect_codec, open_input
+
+EXTENSION = '.parquet'
+ROW_GROUP_SIZE = 100000
+
+# fields that are stored in their own column, with how to compute them from
+# a comment
+FIELDS = {
+    'id': lambda msg: msg.get('id'),
+    'author': lambda msg: msg['author'],
+    'subreddit': lambda msg: msg['subreddit'],
+    'language': lambda msg: msg['language'],
+    'body_length': lambda msg: len(msg['body']),
+    'body_clean_length': lambda msg: len(msg['body_clean']),
+}
+
+
+def is_columnar(filename):
+    return filename.endswith(EXTENSION)
+
+
+def schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('id', pa.string()),
+        ('author', pa.string()),
+        ('subreddit', pa.string()),
+        ('language', pa.string()),
+        ('body_length', pa.int64()),
+        ('body_clean_length', pa.int64()),
+        ('record', pa.string()),
+    ])
+
+
+def jsonl_to_columnar(input_filename, output_filename):
+    """Converts a JSON lines file written by 01_filter.py to a columnar
+    file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table_schema = schema()
+    with open_input(input_filename) as i_f, \
+            pq.ParquetWriter(output_filename, table_schema, compression='zstd') as writer:
+        while True:
+            lines = list(itertools.islice(i_f, ROW_GROUP_SIZE))
+            if not lines:
+                break
+            messages = [json.loads(line) for line in lines]
+            columns = {name: [get(msg) for msg in messages] for name, get in FIELDS.items()}
+            columns['record'] = [line.rstrip('\n') for line in lines]
+            writer.write_table(pa.table(columns, schema=table_schema))
+
+
+def read_fields(filename, fields, skip_errors=False):
+    """Yields a tuple with the given fields (see FIELDS) for every comment of
+    a file. For columnar files, only these columns are read."""
+    if is_columnar(filename):
+        import pyarrow.parquet as pq
+        columns = list(dict.fromkeys(fields))
+        for batch in pq.ParquetFile(filename).iter_batches(columns=columns):
+            data = batch.to_pydict()
+            yield from zip(*(data[f] for f in fields))
+        return
+    getters = [FIELDS[f] for f in fields]
+    with open_input(filename) as i_f:
+        for line in i_f:
+            try:
+                msg = json.loads(line)
+                values = tuple(get(msg) for get in getters)
+            except Exception:
+                if skip_errors:
+                    continue
+                raise
+            yield values
+
+
+def read_records(filename, fields, predicate):
+    """Yields the complete comments of a file whose fields (see FIELDS) are
+    accepted by the predicate, which is called with a tuple of their values.
+    For columnar files, the records are only read and parsed for row groups
+    that contain accepted comments."""
+    if is_columnar(filename):
+        import pyarrow.parquet as pq
+        columns = list(dict.fromkeys(fields))
+        parquet_file = pq.ParquetFile(filename)
+        for i in range(parquet_file.num_row_groups):
+            data = parquet_file.read_row_group(i, columns=columns).to_pydict()
+            rows = [j for j, values in enumerate(zip(*(data[f] for f in fields)))
+                    if predicate(values)]
+            if not rows:
+                continue
+            records = parquet_file.read_row_group(i, columns=['record']).column('record')
+            for record in records.take(rows).to_pylist():
+                yield json.loads(record)
+        return
+    getters = [FIELDS[f] for f in fields]
+    with open_input(filename) as i_f:
+        for line in i_f:
+            msg = json.loads(line)
+            if predicate(tuple(get(msg) for get in getters)):
+                yield msg
+
+
+def read_located_fields(filename, fields):
+    """Like read_fields, but yields (location, values) pairs. A location is
+    the byte offset of a comment in an uncompressed JSON lines file, its
+    line number in a compressed one and its row in a columnar file."""
+    if is_columnar(filename):
+        locations = itertools.count()
+        for values in read_fields(filename, fields):
+            yield next(locations), values
+        return
+    getters = [FIELDS[f] for f in fields]
+    if detect_codec(filename):
+        with open_input(filename) as i_f:
+            for location, line in enumerate(i_f):
+                msg = json.loads(line)
+                yield location, tuple(get(msg) for get in getters)
+        return
+    with open(filename, 'rb') as i_f:
+        location = 0
+        for line in i_f:
+            msg = json.loads(line)
+            yield location, tuple(get(msg) for get in getters)
+            location += len(line)
+
+
+def read_located_records(filename, locations):
+    """Yields (location, comment) pairs for the given sorted locations, only
+    reading what is needed to get there."""
+    if is_columnar(filename):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(filename)
+        locations = list(locations)
+        start = 0
+        position = 0
+        for i in range(parquet_file.num_row_groups):
+            end = start + parquet_file.metadata.row_group(i).num_rows
+            rows = []
+            while position < len(locations) and locations[position] < end:
+                rows.append(locations[position] - start)
+                position += 1
+            if rows:
+                records = parquet_file.read_row_group(i, columns=['record']).column('record')
+                for row, record in zip(rows, records.take(rows).to_pylist()):
+                    yield start + row, json.loads(record)
+            start = end
+        return
+    if detect_codec(filename):
+        wanted = set(locations)
+        with open_input(filename) as i_f:
+            for location, line in enumerate(i_f):
+                if location in wanted:
+                    yield location, json.loads(line)
+        return
+    with open(filename, 'rb') as i_f:
+        for location in locations:
+            i_f.seek(location)
+            yield location, json.loads(i_f.readline())
+
+
+def read_json_lines(filename):
+    """Yields the JSON line of every comment of a file written by
+    01_filter.py, whether it is columnar or not."""
+    if is_columnar(filename):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(filename).iter_batches(columns=['record']):
+            for record in batch.column(0).to_pylist():
+                yield record + '\n'
+        return
+    with open_input(filename) as i_f:
+        yield from i_f
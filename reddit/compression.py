@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transparent (de)compression of Pushshift dump files.
+
+The codec is detected from the file extension, so the RC_20XX files can be
+read directly from the compressed dumps without decompressing them to disk
+first. Files without a known extension are opened as plain text.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+# pushshift compresses its newer dumps with `zstd --long=31`, which needs a
+# larger window than the zstd default allows when decompressing.
+ZSTD_MAX_WINDOW_SIZE = 2 ** 31
+ZSTD_LEVEL = 10
+
+CODECS = {
+    '.zst': 'zst',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.gz': 'gz',
+}
+
+
+def detect_codec(filename):
+    """Returns the codec name for a filename, or None for plain files."""
+    return CODECS.get(os.path.splitext(filename)[1].lower())
+
+
+def strip_codec_extension(filename):
+    if detect_codec(filename):
+        return os.path.splitext(filename)[0]
+    return filename
+
+
+def add_codec_extension(filename, codec):
+    if codec is None:
+        return filename
+    if codec not in CODECS.values():
+        raise ValueError(f'unknown codec: {codec}')
+    return f'{filename}.{codec}'
+
+
+def open_input(filename):
+    """Opens a (possibly compressed) file for reading text line by line."""
+    codec = detect_codec(filename)
+    if codec == 'zst':
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor(
+            max_window_size=ZSTD_MAX_WINDOW_SIZE)
+        # outputs that were resumed consist of several frames
+        stream = decompressor.stream_reader(
+            open(filename, 'rb'), read_across_frames=True)
+        return io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8')
+    if codec == 'bz2':
+        return bz2.open(filename, 'rt', encoding='utf-8')
+    if codec == 'xz':
+        return lzma.open(filename, 'rt', encoding='utf-8')
+    if codec == 'gz':
+        return gzip.open(filename, 'rt', encoding='utf-8')
+    return open(filename)
+
+
+def open_output(filename, append=False):
+    """Opens a file for writing text, compressing it if the extension asks
+    for it. Appending to a compressed file adds a new compressed stream,
+    which open_input reads as a continuation of the previous ones."""
+    codec = detect_codec(filename)
+    mode = 'a' if append else 'w'
+    if codec == 'zst':
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        stream = compressor.stream_writer(open(filename, mode + 'b'))
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    if codec == 'bz2':
+        return bz2.open(filename, mode + 't', encoding='utf-8')
+    if codec == 'xz':
+        return lzma.open(filename, mode + 't', encoding='utf-8')
+    if codec == 'gz':
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Detection of exact duplicate comments, e.g. comments that were ingested
+twice and occur in overlapping dump files.
+
+A comment is keyed by a 64 bit hash of its id and its body_clean. A KeySet
+keeps the keys it has seen in sorted numpy arrays of geometrically growing
+sizes, which are merged like the runs of a log-structured merge tree, so
+it takes 8 bytes per comment and adding n keys takes O(n log n) time. A
+Bloom filter in front of the arrays answers most lookups of keys that were
+not seen before without searching them.
+"""
+
+import numpy as np
+
+from sketches import hash64
+
+# bits of the Bloom filter per key it was sized for, which gives about 3%
+# false positives with 3 hash functions
+BLOOM_BITS_PER_KEY = 8
+BLOOM_MULTIPLIERS = np.array([0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9], dtype=np.uint64)
+INITIAL_CAPACITY = 2 ** 20
+
+
+def comment_key(msg):
+    return hash64(f"{msg.get('id')}\n{msg['body_clean']}")
+
+
+def comment_keys(messages):
+    return np.fromiter((comment_key(msg) for msg in messages), dtype=np.uint64)
+
+
+class KeySet:
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.runs = []
+        self.size = 0
+        self.allocate_bloom(capacity)
+
+    def allocate_bloom(self, capacity):
+        self.capacity = capacity
+        self.bloom_bits = 1 << max(6, int(capacity * BLOOM_BITS_PER_KEY - 1).bit_length())
+        self.bloom = np.zeros(self.bloom_bits // 8, dtype=np.uint8)
+        for run in self.runs:
+            self.set_bloom(run)
+
+    def bloom_positions(self, keys):
+        shift = np.uint64(64 - self.bloom_bits.bit_length() + 1)
+        return [(keys * m) >> shift for m in BLOOM_MULTIPLIERS]
+
+    def set_bloom(self, keys):
+        positions = np.sort(np.concatenate(self.bloom_positions(keys)))
+        byte_positions = positions >> np.uint64(3)
+        starts = np.flatnonzero(np.concatenate(([True], byte_positions[1:] != byte_positions[:-1])))
+        bits = np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+        self.bloom[byte_positions[starts]] |= np.bitwise_or.reduceat(bits, starts)
+
+    def maybe_contains(self, keys):
+        result = np.ones(len(keys), dtype=bool)
+        for positions in self.bloom_positions(keys):
+            bits = self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)
+            result &= (bits & 1).astype(bool)
+        return result
+
+    def contains(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        result = self.maybe_contains(keys)
+        candidates = keys[result]
+        found = np.zeros(len(candidates), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, candidates), len(run) - 1)
+            found |= run[positions] == candidates
+        result[result] = found
+        return result
+
+    def add(self, keys):
+        """Adds the keys and returns which of them are new, i.e. were not in
+        the set before and are the first of several equal keys."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        new = np.zeros(len(keys), dtype=bool)
+        new[np.unique(keys, return_index=True)[1]] = True
+        new &= ~self.contains(keys)
+        self.insert(np.sort(keys[new]))
+        return new
+
+    def insert(self, run):
+        if not len(run):
+            return
+        self.size += len(run)
+        self.runs.append(run)
+        # every run is more than twice as large as the next one
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate((self.runs[-1], last)), kind='mergesort')
+        if self.size > self.capacity:
+            self.allocate_bloom(2 * self.size)
+        else:
+            self.set_bloom(run)
+
+    def __len__(self):
+        return self.size
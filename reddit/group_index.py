@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Binary, memory-mapped storage of the group index of 02_group.py.
+
+The JSON index maps every group (e.g. a language) to the list of targets
+(e.g. authors) that posted in it. In the binary index, the target names are
+interned: they are stored once, sorted, as one UTF-8 blob with an offset
+array, and every group only keeps the sorted ids of its targets. All arrays
+are .npy files that are memory-mapped when the index is loaded, so loading
+does not depend on the size of the index, and overlaps are computed by
+intersecting sorted integer arrays instead of Python sets.
+
+An index is a directory with these files:
+
+    meta.json        fields, input file manifest and group names
+    strings.npy      the UTF-8 encoded target names, concatenated
+    offsets.npy      start of every target name in strings.npy, plus the end
+    postings.npy     the target ids of all groups, concatenated
+    groups.npy       start of every group in postings.npy, plus the end
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+EXTENSION = '.idx'
+POSTING_DTYPE = np.dtype('<u4')
+OFFSET_DTYPE = np.dtype('<i8')
+
+
+def is_binary_index(filename):
+    return filename.endswith(EXTENSION)
+
+
+def write_index(directory, target_field, grouping_field, files, data):
+    """Writes an index given as a dict that maps every group to an iterable
+    of target names. The directory is replaced atomically."""
+    names = sorted(set().union(*data.values())) if data else []
+    if len(names) > np.iinfo(POSTING_DTYPE).max:
+        raise ValueError(f'too many targets for a binary index: {len(names)}')
+    ids = {name: i for i, name in enumerate(names)}
+    encoded = [name.encode('utf-8') for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=OFFSET_DTYPE)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+
+    groups = sorted(data)
+    postings = [np.sort(np.fromiter((ids[t] for t in data[g]), dtype=POSTING_DTYPE))
+                for g in groups]
+    group_offsets = np.zeros(len(groups) + 1, dtype=OFFSET_DTYPE)
+    np.cumsum([len(p) for p in postings], out=group_offsets[1:])
+
+    temporary = directory + '.tmp'
+    if os.path.isdir(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+    np.save(os.path.join(temporary, 'strings.npy'),
+            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(temporary, 'offsets.npy'), offsets)
+    np.save(os.path.join(temporary, 'postings.npy'),
+            np.concatenate(postings) if postings else np.zeros(0, dtype=POSTING_DTYPE))
+    np.save(os.path.join(temporary, 'groups.npy'), group_offsets)
+    with open(os.path.join(temporary, 'meta.json'), 'w') as o_f:
+        json.dump({
+            'target_field': target_field,
+            'grouping_field': grouping_field,
+            'files': files,
+            'groups': groups,
+        }, o_f)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.rename(temporary, directory)
+
+
+class BinaryIndex:
+    """A binary index, with all arrays memory-mapped."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as i_f:
+            meta = json.load(i_f)
+        self.target_field = meta['target_field']
+        self.grouping_field = meta['grouping_field']
+        self.files = meta['files']
+        self.groups = meta['groups']
+        self.group_ids = {g: i for i, g in enumerate(self.groups)}
+
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+        self.strings = load('strings.npy')
+        self.offsets = load('offsets.npy')
+        self.postings = load('postings.npy')
+        self.group_offsets = load('groups.npy')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def target_ids(self, group):
+        i = self.group_ids[group]
+        return self.postings[self.group_offsets[i]:self.group_offsets[i + 1]]
+
+    def target_name(self, target_id):
+        return self.strings[self.offsets[target_id]:self.offsets[target_id + 1]].tobytes().decode('utf-8')
+
+    def target_names(self, target_ids):
+        return [self.target_name(i) for i in target_ids]
+
+    def overlap(self, groups):
+        """Returns the sorted ids of the targets that are in all groups."""
+        arrays = sorted((self.target_ids(g) for g in groups), key=len)
+        if not arrays:
+            return np.zeros(0, dtype=POSTING_DTYPE)
+        result = np.asarray(arrays[0])
+        for array in arrays[1:]:
+            if not len(result):
+                break
+            result = intersect_sorted(result, array)
+        return result
+
+
+def intersect_sorted(small, large):
+    """Intersects two sorted arrays of unique ids by looking up the elements
+    of the smaller one in the larger one."""
+    positions = np.searchsorted(large, small)
+    found = positions < len(large)
+    found[found] = large[positions[found]] == small[found]
+    return small[found]
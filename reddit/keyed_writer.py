@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Writing the posts of many keys (e.g. authors) to one file per key, like
+02_group.py does for corpora without a grouping field.
+"""
+
+import json
+import os
+import tempfile
+from collections import OrderedDict, defaultdict
+
+MAX_OPEN_FILES = 256
+BUFFER_SIZE = 2 ** 24
+
+
+class HandlePool:
+    """Appends to many files, keeping at most max_open of them open. The
+    least recently used handle is closed first."""
+
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        self.handles = OrderedDict()
+
+    def write(self, filename, text):
+        handle = self.handles.pop(filename, None)
+        if handle is None:
+            if len(self.handles) >= self.max_open:
+                _, oldest = self.handles.popitem(last=False)
+                oldest.close()
+            handle = open(filename, 'a')
+        self.handles[filename] = handle
+        handle.write(text)
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = OrderedDict()
+
+
+class ThresholdWriter:
+    """Writes the lines of every key that gets at least threshold lines to
+    <directory>/<key>.json, in the order they were added.
+
+    Lines of keys that reached the threshold are buffered up to buffer_size
+    characters in total. Lines of keys that did not reach it yet are kept in
+    memory up to pending_size characters (without a limit if it is None);
+    beyond that they are spilled to a temporary file, together with all
+    later lines of the same keys, and written when the writer is closed.
+    """
+
+    def __init__(self, directory, threshold, buffer_size=BUFFER_SIZE, pending_size=None,
+                 max_open=MAX_OPEN_FILES):
+        self.directory = directory
+        self.threshold = threshold
+        self.buffer_size = buffer_size
+        self.pending_size = pending_size
+        self.counts = defaultdict(int)
+        self.pending = {}
+        self.pending_bytes = 0
+        self.spilled = set()
+        self.spill = None
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.pool = HandlePool(max_open)
+
+    def add(self, key, line):
+        self.counts[key] += 1
+        if key in self.spilled:
+            self.spill.write(json.dumps(key) + '\t' + line)
+        elif self.counts[key] > self.threshold:
+            self.buffer(key, line)
+        else:
+            self.pending.setdefault(key, []).append(line)
+            self.pending_bytes += len(line)
+            if self.counts[key] == self.threshold:
+                lines = self.pending.pop(key)
+                self.pending_bytes -= sum(len(l) for l in lines)
+                for l in lines:
+                    self.buffer(key, l)
+            elif self.pending_size is not None and self.pending_bytes > self.pending_size:
+                self.spill_pending()
+
+    def spill_pending(self):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile('w+', dir=self.directory, suffix='.spill')
+        for key, lines in self.pending.items():
+            prefix = json.dumps(key) + '\t'
+            self.spill.writelines(prefix + l for l in lines)
+            self.spilled.add(key)
+        self.pending = {}
+        self.pending_bytes = 0
+
+    def buffer(self, key, line):
+        self.buffers[key].append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for key, lines in self.buffers.items():
+            self.pool.write(os.path.join(self.directory, key + '.json'), ''.join(lines))
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+
+    def close(self):
+        """Writes the remaining lines and returns the number of keys that
+        reached the threshold."""
+        if self.spill is not None:
+            self.spill.seek(0)
+            for row in self.spill:
+                key, line = row.split('\t', 1)
+                key = json.loads(key)
+                if self.counts[key] >= self.threshold:
+                    self.buffer(key, line)
+            self.spill.close()
+            self.spill = None
+        self.flush()
+        self.pool.close()
+        return sum(1 for count in self.counts.values() if count >= self.threshold)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Language identification backends for 01_filter.py.
+
+All backends score a batch of texts at once. For each text, they return the
+(language, probability) pairs sorted by descending probability, or the
+exception that was raised while scoring this text, so that a single bad
+comment does not discard the whole batch.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+# languages below this probability are not reported, like in langdetect
+MIN_PROBABILITY = 0.1
+MAX_NGRAM = 3
+MAX_CACHED_WORDS = 2 ** 20
+# naive Bayes treats the overlapping n-grams of a text as independent, which
+# makes the posterior saturate at 0 or 1 after a few words. The summed
+# log-likelihoods are scaled down to the evidence of at most this many
+# n-grams, so the probabilities stay comparable to a threshold
+EFFECTIVE_NGRAMS = 20
+
+# runs of letters, everything else separates words
+WORD_PATTERN = re.compile(r'[^\W\d_]+')
+
+
+class LangdetectIdentifier:
+    """The langdetect library, scoring one text after another."""
+
+    def __init__(self, seed=None):
+        from langdetect import DetectorFactory, detect_langs
+        if seed is not None:
+            DetectorFactory.seed = seed
+        self.detect_langs = detect_langs
+
+    def identify(self, texts):
+        result = []
+        for text in texts:
+            try:
+                scores = sorted(self.detect_langs(text), key=lambda x: x.prob, reverse=True)
+                result.append([(x.lang, x.prob) for x in scores])
+            except Exception as e:
+                result.append(e)
+        return result
+
+
+def default_profile_directory():
+    import langdetect
+    return os.path.join(os.path.dirname(langdetect.__file__), 'profiles')
+
+
+def lower_ngram(gram):
+    """The lowercase n-gram, unless lowercasing changes its length."""
+    lowered = gram.lower()
+    return lowered if len(lowered) == len(gram) else gram
+
+
+def extract_ngrams(word):
+    """Character 1- to 3-grams of a word, with the word boundaries marked by
+    spaces like in the langdetect profiles."""
+    padded = f' {word} '
+    grams = list(word)
+    for n in range(2, MAX_NGRAM + 1):
+        grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class NgramIdentifier:
+    """A deterministic naive Bayes model over character n-grams, built from
+    the language profiles shipped with langdetect (one JSON file per
+    language with the n-gram frequencies).
+
+    The profiles and the texts are lowercased, so words in capitals are
+    scored like any other word. The log-probabilities of all n-grams are
+    kept in one matrix, so a batch is scored with a single gather and a
+    segmented sum.
+    """
+
+    def __init__(self, profile_directory=None, languages=None):
+        if profile_directory is None:
+            profile_directory = default_profile_directory()
+        if languages is None:
+            languages = sorted(os.listdir(profile_directory))
+        profiles = []
+        for language in languages:
+            with open(os.path.join(profile_directory, language)) as i_f:
+                profiles.append(json.load(i_f))
+
+        self.languages = [p['name'] for p in profiles]
+        self.vocabulary = {}
+        for p in profiles:
+            for gram in p['freq']:
+                self.vocabulary.setdefault(lower_ngram(gram), len(self.vocabulary))
+        self.word_cache = {}
+
+        # additive smoothing per n-gram order
+        counts = np.zeros((len(self.vocabulary), len(profiles)), dtype=np.float32)
+        totals = np.zeros((MAX_NGRAM, len(profiles)), dtype=np.float64)
+        for j, p in enumerate(profiles):
+            for gram, count in p['freq'].items():
+                counts[self.vocabulary[lower_ngram(gram)], j] += count
+            totals[:, j] = p['n_words'][:MAX_NGRAM]
+        orders = np.array([len(gram) - 1 for gram in self.vocabulary], dtype=np.intp)
+        self.log_probabilities = (
+            np.log(counts + 1) - np.log(totals[orders] + len(self.vocabulary))
+        ).astype(np.float32)
+
+    def word_indices(self, word):
+        indices = self.word_cache.get(word)
+        if indices is None:
+            if len(self.word_cache) >= MAX_CACHED_WORDS:
+                self.word_cache.clear()
+            indices = [self.vocabulary[g] for g in extract_ngrams(word) if g in self.vocabulary]
+            self.word_cache[word] = indices
+        return indices
+
+    def identify(self, texts):
+        indices = []
+        offsets = []
+        for text in texts:
+            offsets.append(len(indices))
+            for word in WORD_PATTERN.findall(text.lower()):
+                indices.extend(self.word_indices(word))
+        offsets.append(len(indices))
+
+        scores = np.zeros((len(texts), len(self.languages)), dtype=np.float64)
+        non_empty = [i for i in range(len(texts)) if offsets[i + 1] > offsets[i]]
+        if non_empty:
+            gathered = self.log_probabilities[np.array(indices, dtype=np.intp)]
+            starts = np.array([offsets[i] for i in non_empty], dtype=np.intp)
+            scores[non_empty] = np.add.reduceat(gathered, starts, axis=0)
+        n_grams = np.diff(np.array(offsets, dtype=np.float64))
+        scores *= np.minimum(1.0, EFFECTIVE_NGRAMS / np.maximum(n_grams, 1))[:, None]
+
+        # softmax over the languages gives the posterior under a uniform prior
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        result = []
+        for i in range(len(texts)):
+            if offsets[i + 1] == offsets[i]:
+                result.append(ValueError('No features in text.'))
+                continue
+            order = np.argsort(-probabilities[i])
+            languages = [(self.languages[j], float(probabilities[i, j])) for j in order
+                         if probabilities[i, j] > MIN_PROBABILITY]
+            result.append(languages or [(self.languages[order[0]], float(probabilities[i, order[0]]))])
+        return result
+
+
+def create_identifier(name, seed=None, profile_directory=None, languages=None):
+    if name == 'langdetect':
+        return LangdetectIdentifier(seed=seed)
+    if name == 'ngram':
+        return NgramIdentifier(profile_directory=profile_directory, languages=languages)
+    raise ValueError(f'unknown language identifier: {name}')
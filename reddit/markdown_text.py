@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single-pass conversion of reddit markdown to plain text.
+
+Produces the same text as rendering the markdown with hoep and calling
+get_text() on the HTML parsed by BeautifulSoup, without building a DOM.
+
+markdown_to_text handles comments that consist of paragraphs, hard line
+breaks, backslash escapes and the common entities directly. For the others
+(emphasis, code, links, lists, quotes, headers), rendered_to_text extracts
+the text from the HTML rendered by hoep with a tokenizer. Both return None
+if they cannot guarantee the same result, e.g. for inline HTML, and the
+caller has to fall back to BeautifulSoup.
+"""
+
+import re
+
+# characters that hoep accepts after a backslash
+ESCAPABLE = '\\`*_{}[]()#+-.!:|&<>^~'
+
+ENTITIES = {
+    'amp': '&',
+    'lt': '<',
+    'gt': '>',
+    'quot': '"',
+    'nbsp': '\xa0',
+}
+
+# lines that could start something else than a paragraph: headers, quotes,
+# lists, rules, setext underlines, html blocks and fenced code
+BLOCK_PATTERN = re.compile(r'^ *(?:[-#>=+*_<`~]|\d+\.)', re.MULTILINE)
+
+# control characters are treated differently by the HTML parser
+UNSUPPORTED_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+
+TAG_PATTERN = re.compile(r'(<[^>]*>)')
+ENTITY_PATTERN = re.compile(r'&(#?[A-Za-z0-9]+);')
+
+# whitespace-only strings outside of these tags are collapsed by BeautifulSoup
+PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+ASCII_SPACES = ' \n\t\x0c\r'
+
+INLINE_PATTERN = re.compile(
+    r'\\([' + re.escape(ESCAPABLE) + r'])'  # escaped character
+    r'|&(#?[A-Za-z0-9]+);'                  # entity
+    r'| {2,}\n'                             # hard line break
+    r'|[*_`\[<]')                           # emphasis, code, links, html
+
+
+def decode_entity(name):
+    if not name.startswith('#'):
+        return ENTITIES.get(name)
+    try:
+        if name[1:2] in ('x', 'X'):
+            codepoint = int(name[2:], 16)
+        else:
+            codepoint = int(name[1:])
+    except ValueError:
+        return None
+    # a decoded space would change how whitespace is collapsed
+    if (0x20 < codepoint < 0x7f or 0xa0 <= codepoint < 0xd800
+            or 0xe000 <= codepoint < 0xfffe or 0x10000 <= codepoint < 0x110000):
+        return chr(codepoint)
+    return None
+
+
+def render_inline(text):
+    parts = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        parts.append(text[position:match.start()])
+        position = match.end()
+        token = match.group()
+        if match.group(1) is not None:
+            parts.append(match.group(1))
+        elif match.group(2) is not None:
+            character = decode_entity(match.group(2))
+            if character is None:
+                return None
+            parts.append(character)
+        elif token.endswith('\n'):
+            parts.append('\n')
+        else:
+            return None
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def expand_tabs(line):
+    # hoep expands tabs to 4 columns, counting the columns in UTF-8 bytes
+    parts = line.split('\t')
+    column = 0
+    result = []
+    for part in parts[:-1]:
+        column += len(part.encode('utf-8'))
+        spaces = 4 - column % 4
+        column += spaces
+        result.append(part + ' ' * spaces)
+    result.append(parts[-1])
+    return ''.join(result)
+
+
+def split_paragraphs(text):
+    paragraphs = []
+    current = []
+    for line in text.split('\n'):
+        if line.strip(' '):
+            current.append(line)
+        elif current:
+            paragraphs.append(current)
+            current = []
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+
+def markdown_to_text(text):
+    """Returns the plain text of a markdown document, or None if the document
+    needs the full markdown renderer."""
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if '\t' in text:
+        text = '\n'.join(expand_tabs(line) for line in text.split('\n'))
+    if UNSUPPORTED_PATTERN.search(text) or BLOCK_PATTERN.search(text):
+        return None
+
+    result = []
+    for lines in split_paragraphs(text):
+        # an indented first line starts a code block
+        if lines[0].startswith('    '):
+            return None
+        paragraph = render_inline('\n'.join(lines).lstrip(' '))
+        if paragraph is None:
+            return None
+        result.append(paragraph)
+    if not result:
+        return ''
+    return '\n'.join(result) + '\n'
+
+
+def decode_entities(text):
+    if '&' not in text:
+        return text
+    parts = []
+    position = 0
+    for match in ENTITY_PATTERN.finditer(text):
+        character = decode_entity(match.group(1))
+        if character is None:
+            return None
+        parts.append(text[position:match.start()])
+        parts.append(character)
+        position = match.end()
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def rendered_to_text(markdown, html):
+    """Returns the text of the HTML that hoep rendered from markdown, or None
+    if the markdown contains inline HTML or unknown entities."""
+    # without '<' in the markdown, all tags in the HTML come from hoep and
+    # are well-formed
+    if '<' in markdown or UNSUPPORTED_PATTERN.search(markdown):
+        return None
+    result = []
+    preserve = 0
+    for i, token in enumerate(TAG_PATTERN.split(html)):
+        if i % 2:
+            name = token.strip('</>').split(' ', 1)[0]
+            if name in PRESERVE_WHITESPACE_TAGS:
+                preserve += -1 if token.startswith('</') else 1
+            continue
+        if not token:
+            continue
+        text = decode_entities(token)
+        if text is None:
+            return None
+        if not preserve and not text.strip(ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        result.append(text)
+    return ''.join(result)
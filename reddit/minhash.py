@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+MinHash signatures of comments and locality sensitive hashing (LSH) of
+them, for finding near-duplicates without comparing all pairs.
+
+The shingles of a text are its overlapping runs of shingle_size words, after
+lowercasing and removing punctuation. Every value of a signature is the
+minimum of the shingle hashes under one of num_perm random hash functions,
+and two texts agree in it with a probability equal to the Jaccard similarity
+of their shingles. LSH splits the signatures into bands of rows and hashes
+every band to a key; texts that share a key in any band are candidates,
+which catches pairs with a similarity above about (1 / bands) ** (1 / rows).
+"""
+
+import zlib
+
+import numpy as np
+
+from cleaning import PUNCTUATION_TABLE
+
+SEED = 42
+# the keys of a band are folded with the FNV-1a prime, starting from a
+# value that depends on the band, so equal rows in different bands differ
+FOLD_PRIME = np.uint64(0x100000001b3)
+FOLD_OFFSET = np.uint64(0xcbf29ce484222325)
+
+
+class MinHasher:
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=SEED):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # multiply-shift hash functions, with odd multipliers
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2 ** 64 - 1, num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 64 - 1, num_perm, dtype=np.uint64, endpoint=True)
+
+    def shingles(self, text):
+        """The distinct 32 bit hashes of the shingles of a text."""
+        words = text.lower().translate(PUNCTUATION_TABLE).split()
+        n = self.shingle_size
+        grams = {' '.join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = (self.shingles(text)[:, None] * self.a + self.b) >> np.uint64(32)
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts):
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, text in enumerate(texts):
+            result[i] = self.signature(text)
+        return result
+
+
+def band_keys(signatures, bands):
+    """The 64 bit keys of the bands of every signature, as an array of
+    shape (number of signatures, bands)."""
+    rows = signatures.shape[1] // bands
+    values = signatures[:, :bands * rows].reshape(len(signatures), bands, rows).astype(np.uint64)
+    keys = np.broadcast_to(FOLD_OFFSET ^ np.arange(bands, dtype=np.uint64), values.shape[:2]).copy()
+    for row in range(rows):
+        keys = (keys ^ values[:, :, row]) * FOLD_PRIME
+    return keys
+
+
+def similarity(signature, other):
+    """The estimated Jaccard similarity of the texts of two signatures."""
+    return float(np.mean(signature == other))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sets of names (authors, subreddits) for the limits of 02_group.py, e.g.
+allowlists of millions of authors from an earlier run.
+
+A NameSet of up to max_frozen names is frozen: it keeps them in a frozenset,
+which answers membership tests fastest and can be iterated. A larger one is
+hashed: it only keeps a sorted array of the 64 bit hashes of the names, 8
+bytes per name, and looks names up by binary search. Two names share a hash
+with a negligible probability.
+"""
+
+import numpy as np
+
+from sketches import hash64
+
+MAX_FROZEN_SIZE = 100000
+
+
+def read_names(filename):
+    """The names of a file with one name per line. Empty lines and lines
+    starting with # are ignored."""
+    with open(filename) as i_f:
+        names = [line.strip() for line in i_f]
+    return [n for n in names if n and not n.startswith('#')]
+
+
+class NameSet:
+
+    def __init__(self, names, max_frozen=MAX_FROZEN_SIZE):
+        names = list(names)
+        self.names = None
+        self.hashes = None
+        if len(names) <= max_frozen:
+            self.names = frozenset(names)
+        else:
+            self.hashes = np.unique(np.fromiter((hash64(n) for n in names), dtype=np.uint64))
+
+    @property
+    def frozen(self):
+        return self.names is not None
+
+    def __contains__(self, name):
+        if self.names is not None:
+            return name in self.names
+        if not isinstance(name, str):
+            return False
+        key = np.uint64(hash64(name))
+        position = np.searchsorted(self.hashes, key)
+        return position < len(self.hashes) and self.hashes[position] == key
+
+    def __len__(self):
+        return len(self.names) if self.names is not None else len(self.hashes)
+
+    def __iter__(self):
+        if self.names is None:
+            raise TypeError('the names of a hashed NameSet cannot be listed')
+        return iter(self.names)
+
+    def __repr__(self):
+        return f'NameSet({len(self)} names)'
+
+
+def is_listable(names):
+    """Whether the names of a limit can be listed, which is not the case for
+    a hashed NameSet."""
+    return not isinstance(names, NameSet) or names.frozen
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <https://www.gnu.org/licenses/>.
+
+# Finds clusters of near-duplicate comments (copypasta, templates) in the
+# output of 01_filter.py, across all input files. The clusters are written
+# as JSON lines with the id of every comment in a cluster and the id of the
+# cluster, which is the id of its first comment in the order of the input
+# files. 02_group.py drops or dedupes them with --near-duplicates.
+#
+# The comments are processed in three steps:
+#  1. the MinHash signatures of the body_clean of the comments of every
+#     file are stored in the work directory, and their LSH band keys are
+#     partitioned by key into buckets on disk
+#  2. the band keys of every bucket are sorted, comments with the same key
+#     are compared by their signatures and the similar ones are linked
+#  3. the linked comments are merged into clusters
+# Only one bucket per process is in memory at a time, and the clusters only
+# hold the comments that have a near-duplicate.
+
+from collections import defaultdict
+
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from buckets import bucket_directory, bucket_files, count_buckets
+from columnar import read_records
+from minhash import MinHasher, band_keys, similarity
+from parallel import map_tasks
+
+logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s: %(message)s')
+
+BAND_DTYPE = np.dtype([('key', '<u8'), ('comment', '<i8')])
+# a comment is identified by the number of its file and its row in the file
+ROW_BITS = 40
+BATCH_SIZE = 10000
+
+parser = argparse.ArgumentParser(description='Finds clusters of near-duplicate comments in the output of 01_filter.py.')
+parser.add_argument('-i', '--input-pattern', required=True, help='glob pattern for the files written by 01_filter.py')
+parser.add_argument('-o', '--output-file', required=True, help='JSON lines file to store the clusters to')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+parser.add_argument('-w', '--work-directory', default=None, help='where to store the signatures and buckets while working [next to the output file]')
+parser.add_argument('--num-perm', type=int, default=128, help='number of values of a MinHash signature [128]')
+parser.add_argument('--bands', type=int, default=16, help='number of LSH bands the signatures are split into [16]')
+parser.add_argument('--shingle-size', type=int, default=3, help='number of words per shingle [3]')
+parser.add_argument('--threshold', type=float, default=0.8, help='minimum estimated Jaccard similarity of near-duplicates [0.8]')
+parser.add_argument('--memory-budget', type=int, default=1024, help='memory per process for sorting a bucket of band keys (in MB) [1024]')
+args = parser.parse_args()
+
+if args.num_perm % args.bands:
+    parser.error('--num-perm must be a multiple of --bands')
+
+hasher = MinHasher(args.num_perm, args.shingle_size)
+
+
+def signature_filename(work_directory, file_number):
+    return os.path.join(work_directory, 'signatures', f'{file_number:05d}.sig')
+
+def ids_filename(work_directory, file_number):
+    return os.path.join(work_directory, 'signatures', f'{file_number:05d}.ids')
+
+def write_bands(keys, first_comment, directory, name, n_buckets):
+    records = np.empty(keys.size, dtype=BAND_DTYPE)
+    records['key'] = keys.ravel()
+    records['comment'] = np.repeat(np.arange(first_comment, first_comment + len(keys)), keys.shape[1])
+    buckets = records['key'] % np.uint64(n_buckets)
+    order = np.argsort(buckets, kind='stable')
+    records = records[order]
+    bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1))
+    for bucket in range(n_buckets):
+        if bounds[bucket] == bounds[bucket + 1]:
+            continue
+        path = bucket_directory(directory, bucket)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, name), 'ab') as o_f:
+            records[bounds[bucket]:bounds[bucket + 1]].tofile(o_f)
+
+def hash_file(arguments):
+    """Stores the signatures and ids of the comments of a file and writes
+    their band keys to the buckets. Returns the number of comments."""
+    file_number, filename, work_directory, n_buckets = arguments
+    bands_directory = os.path.join(work_directory, 'bands')
+    name = f'{file_number:05d}.bin'
+    row = 0
+    with open(signature_filename(work_directory, file_number), 'wb') as signature_file, \
+            open(ids_filename(work_directory, file_number), 'w') as ids_file:
+        batch = []
+        for msg in read_records(filename, ['id'], lambda values: True):
+            batch.append(msg)
+            if len(batch) >= BATCH_SIZE:
+                hash_batch(batch, file_number, row, signature_file, ids_file, bands_directory, name, n_buckets)
+                row += len(batch)
+                batch = []
+        if batch:
+            hash_batch(batch, file_number, row, signature_file, ids_file, bands_directory, name, n_buckets)
+            row += len(batch)
+    return row
+
+def hash_batch(batch, file_number, row, signature_file, ids_file, bands_directory, name, n_buckets):
+    signatures = hasher.signatures([msg['body_clean'] for msg in batch])
+    signatures.tofile(signature_file)
+    ids_file.writelines(json.dumps(msg.get('id')) + '\n' for msg in batch)
+    write_bands(band_keys(signatures, args.bands), (file_number << ROW_BITS) + row,
+                bands_directory, name, n_buckets)
+
+signature_cache = {}
+
+def load_signature(work_directory, comment):
+    file_number = comment >> ROW_BITS
+    if file_number not in signature_cache:
+        signature_cache[file_number] = np.memmap(
+            signature_filename(work_directory, file_number), dtype=np.uint32, mode='r').reshape(-1, args.num_perm)
+    return signature_cache[file_number][comment & ((1 << ROW_BITS) - 1)]
+
+def link_bucket(arguments):
+    """Returns the pairs of similar comments that share a band key in a
+    bucket, as (earlier comment, later comment) rows."""
+    bucket, work_directory = arguments
+    bands_directory = os.path.join(work_directory, 'bands')
+    files = bucket_files(bands_directory, bucket)
+    if not files:
+        return np.empty((0, 2), dtype=np.int64)
+    records = np.concatenate([np.fromfile(f, dtype=BAND_DTYPE) for f in files])
+    records = records[np.lexsort((records['comment'], records['key']))]
+    keys = records['key']
+    # the comments with the same key follow each other. Every comment is
+    # compared with the comments of its run that were not similar to an
+    # earlier one, and linked to the first similar one
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    run_lengths = np.diff(np.append(starts, len(keys)))
+    pairs = []
+    for start, length in zip(starts[run_lengths > 1].tolist(), run_lengths[run_lengths > 1].tolist()):
+        representatives = []
+        for comment in records['comment'][start:start + length].tolist():
+            signature = load_signature(work_directory, comment)
+            for representative, representative_signature in representatives:
+                if similarity(representative_signature, signature) >= args.threshold:
+                    pairs.append((representative, comment))
+                    break
+            else:
+                representatives.append((comment, signature))
+    shutil.rmtree(bucket_directory(bands_directory, bucket))
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+def find_root(parents, comment):
+    root = comment
+    while parents[root] != root:
+        root = parents[root]
+    while parents[comment] != root:
+        parents[comment], comment = root, parents[comment]
+    return root
+
+def merge_pairs(parents, pairs):
+    """Merges the clusters of every pair, the root of a cluster is its
+    smallest comment, i.e. the first one in the order of the files."""
+    for first, other in pairs.tolist():
+        parents.setdefault(first, first)
+        parents.setdefault(other, other)
+        first, other = find_root(parents, first), find_root(parents, other)
+        if first != other:
+            parents[max(first, other)] = min(first, other)
+
+def read_ids(work_directory, comments):
+    """The ids of the given comments."""
+    rows = defaultdict(set)
+    for comment in comments:
+        rows[comment >> ROW_BITS].add(comment & ((1 << ROW_BITS) - 1))
+    ids = {}
+    for file_number, file_rows in rows.items():
+        with open(ids_filename(work_directory, file_number)) as i_f:
+            for row, line in enumerate(i_f):
+                if row in file_rows:
+                    ids[(file_number << ROW_BITS) + row] = json.loads(line)
+    return ids
+
+
+files = sorted(glob.glob(args.input_pattern))
+logging.info(f'read {len(files)} files, starting work')
+work_directory = tempfile.mkdtemp(
+    dir=args.work_directory or os.path.dirname(os.path.abspath(args.output_file)), suffix='.near_duplicates')
+memory_budget = args.memory_budget * 2 ** 20
+try:
+    os.makedirs(os.path.join(work_directory, 'signatures'))
+    # the band keys of a comment take less space than its JSON, so the size
+    # of the input files bounds the size of the buckets, unless they are
+    # compressed
+    n_buckets = count_buckets(sum(os.path.getsize(f) for f in files), memory_budget)
+    logging.info(f'hashing the comments into {n_buckets} buckets')
+    arguments = [(file_number, filename, work_directory, n_buckets)
+                 for file_number, filename in enumerate(files)]
+    n_comments = sum(map_tasks(hash_file, arguments, args.jobs))
+
+    logging.info(f'comparing the candidates among {n_comments} comments')
+    parents = {}
+    for pairs in map_tasks(link_bucket, [(bucket, work_directory) for bucket in range(n_buckets)], args.jobs):
+        merge_pairs(parents, pairs)
+
+    roots = {comment: find_root(parents, comment) for comment in parents}
+    ids = read_ids(work_directory, roots)
+    n_clusters = 0
+    with open(args.output_file, 'w') as o_f:
+        for comment in sorted(roots):
+            root = roots[comment]
+            n_clusters += comment == root
+            o_f.write(json.dumps({'id': ids[comment], 'cluster': ids[root]}) + '\n')
+    logging.info(f'found {n_clusters} clusters with {len(roots)} comments')
+finally:
+    shutil.rmtree(work_directory)
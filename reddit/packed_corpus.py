@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reading and writing generated corpora, in the directory or packed layout.
+
+In the directory layout of 02_group.py, every post is a file of its own,
+<target>/<group>/<post>.json. A packed corpus stores the same posts in a
+few large shard files instead, with an index of where each post is:
+
+    corpus.json         the format and the names of the shard files
+    index.jsonl         one [target, group, post, shard, offset, length,
+                        body length] list per post
+    shard-00000.jsonl   the posts, one per line
+
+The shard names are relative to the corpus directory, so a corpus can refer
+to the shards of another one, like 03_postfilter.py does instead of
+creating symlinks for a packed input corpus. corpus.json is written last, a
+directory without it is not a (complete) packed corpus.
+
+Both layouts are read with the same API, see open_corpus.
+
+Next to the posts of the directory layout, .lengths.jsonl can store one
+[target, group, post, body length] list per post, so that the posts can be
+listed and filtered by length without reading them, like with the index of
+a packed corpus. 02_group.py writes it, otherwise it is built on first use.
+It is hidden, so that tools which take every entry of the corpus directory
+for a target do not pick it up.
+"""
+
+import json
+import logging
+import os
+from collections import defaultdict, namedtuple
+
+META_FILENAME = 'corpus.json'
+INDEX_FILENAME = 'index.jsonl'
+LENGTHS_FILENAME = '.lengths.jsonl'
+SHARD_SIZE = 2 ** 30
+
+Entry = namedtuple('Entry', ['target', 'group', 'post', 'shard', 'offset', 'length', 'body_length'])
+
+
+def is_packed(directory):
+    return os.path.isfile(os.path.join(directory, META_FILENAME))
+
+
+def write_lengths(directory, lengths):
+    """Writes the length manifest from (target, group, post, length)
+    tuples."""
+    filename = os.path.join(directory, LENGTHS_FILENAME)
+    with open(filename + '.tmp', 'w') as o_f:
+        for row in lengths:
+            o_f.write(json.dumps(list(row)) + '\n')
+    os.replace(filename + '.tmp', filename)
+
+
+class DirectoryCorpus:
+    """A corpus in the directory layout. After load_lengths, the posts and
+    their lengths are taken from the length manifest."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lengths = None
+
+    def load_lengths(self, build=True):
+        """Loads the length manifest, building it first if there is none and
+        build is set."""
+        filename = os.path.join(self.directory, LENGTHS_FILENAME)
+        if not os.path.isfile(filename):
+            if build:
+                self.build_lengths()
+            return
+        self.lengths = defaultdict(dict)
+        with open(filename) as i_f:
+            for line in i_f:
+                target, group, post, length = json.loads(line)
+                self.lengths[target].setdefault(group, {})[post] = length
+
+    def build_lengths(self):
+        logging.info(f'building the length manifest of {self.directory}')
+        lengths = defaultdict(dict)
+        rows = []
+        for target in self.targets():
+            for group in self.groups(target):
+                for post in self.posts(target, group):
+                    length = self.body_length(target, group, post)
+                    lengths[target].setdefault(group, {})[post] = length
+                    rows.append((target, group, post, length))
+        try:
+            write_lengths(self.directory, rows)
+        except OSError as e:
+            logging.warning(f'could not store the length manifest: {e}')
+        self.lengths = lengths
+
+    def targets(self):
+        if self.lengths is not None:
+            return sorted(self.lengths)
+        return sorted(t for t in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, t)))
+
+    def groups(self, target):
+        if self.lengths is not None:
+            return sorted(self.lengths[target])
+        return sorted(os.listdir(os.path.join(self.directory, target)))
+
+    def posts(self, target, group):
+        if self.lengths is not None:
+            return sorted(self.lengths[target][group])
+        return sorted(p for p in os.listdir(os.path.join(self.directory, target, group))
+                      if p.endswith('.json'))
+
+    def path(self, target, group, post):
+        return os.path.join(self.directory, target, group, post)
+
+    def read_text(self, target, group, post):
+        with open(self.path(target, group, post)) as i_f:
+            return i_f.read()
+
+    def read(self, target, group, post):
+        return json.loads(self.read_text(target, group, post))
+
+    def body_length(self, target, group, post):
+        if self.lengths is not None:
+            return self.lengths[target][group][post]
+        return len(self.read(target, group, post)['body'])
+
+
+class PackedCorpus:
+    """A packed corpus. The index is loaded completely, the posts are read
+    from the shards on demand."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILENAME)) as i_f:
+            meta = json.load(i_f)
+        self.shards = meta['shards']
+        self.entries = defaultdict(dict)
+        with open(os.path.join(directory, INDEX_FILENAME)) as i_f:
+            for line in i_f:
+                entry = Entry(*json.loads(line))
+                self.entries[entry.target].setdefault(entry.group, {})[entry.post] = entry
+        self.handles = {}
+
+    def targets(self):
+        return sorted(self.entries)
+
+    def groups(self, target):
+        return sorted(self.entries[target])
+
+    def posts(self, target, group):
+        return sorted(self.entries[target][group])
+
+    def entry(self, target, group, post):
+        return self.entries[target][group][post]
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, self.shards[shard])
+
+    def read_text(self, target, group, post):
+        entry = self.entry(target, group, post)
+        handle = self.handles.get(entry.shard)
+        if handle is None:
+            handle = self.handles[entry.shard] = open(self.shard_path(entry.shard), 'rb')
+        handle.seek(entry.offset)
+        return handle.read(entry.length).decode('utf-8')
+
+    def read(self, target, group, post):
+        return json.loads(self.read_text(target, group, post))
+
+    def body_length(self, target, group, post):
+        return self.entry(target, group, post).body_length
+
+    def load_lengths(self, build=True):
+        # the index has the lengths already
+        pass
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+
+def open_corpus(directory):
+    if is_packed(directory):
+        return PackedCorpus(directory)
+    return DirectoryCorpus(directory)
+
+
+def create_links(corpus, directory, target, group, posts):
+    """Creates relative symlinks in directory to posts of a corpus in the
+    directory layout."""
+    group_dir = os.path.join(directory, target, group)
+    os.makedirs(group_dir, exist_ok=True)
+    source_dir = os.path.relpath(os.path.join(corpus.directory, target, group), group_dir)
+    for post in posts:
+        os.symlink(os.path.join(source_dir, post), os.path.join(group_dir, post))
+
+
+class DirectoryWriter:
+    """Writes a corpus in the directory layout, with its length manifest."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lengths = None
+
+    def write(self, target, group, post, text, body_length=None):
+        if body_length is None:
+            body_length = len(json.loads(text)['body'])
+        group_dir = os.path.join(self.directory, target, group)
+        if not os.path.isdir(group_dir):
+            os.makedirs(group_dir)
+        with open(os.path.join(group_dir, post), 'w') as o_f:
+            o_f.write(text)
+        self.write_length(target, group, post, body_length)
+
+    def link(self, corpus, target, group, posts):
+        """Adds posts of another corpus in the directory layout as relative
+        symlinks."""
+        create_links(corpus, self.directory, target, group, posts)
+        self.record_links(corpus, target, group, posts)
+
+    def record_links(self, corpus, target, group, posts):
+        """Adds the lengths of posts that were linked with create_links."""
+        for post in posts:
+            self.write_length(target, group, post, corpus.body_length(target, group, post))
+
+    def write_length(self, target, group, post, body_length):
+        if self.lengths is None:
+            self.lengths = open(os.path.join(self.directory, LENGTHS_FILENAME + '.tmp'), 'w')
+        self.lengths.write(json.dumps([target, group, post, body_length]) + '\n')
+
+    def close(self):
+        if self.lengths is not None:
+            self.lengths.close()
+            filename = os.path.join(self.directory, LENGTHS_FILENAME)
+            os.replace(filename + '.tmp', filename)
+            self.lengths = None
+
+
+class PackedWriter:
+    """Writes a packed corpus. Posts are appended to the current shard until
+    it reaches shard_size bytes. Entries of another packed corpus can be
+    added without copying the posts, see link."""
+
+    def __init__(self, directory, shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.shards = []
+        self.shard_numbers = {}
+        self.shard = None
+        self.shard_number = None
+        self.position = 0
+        self.index = open(os.path.join(directory, INDEX_FILENAME), 'w')
+
+    def new_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        name = f'shard-{len(self.shard_numbers):05d}.jsonl'
+        self.shard_number = self.add_shard(os.path.join(self.directory, name))
+        self.shard = open(os.path.join(self.directory, name), 'wb')
+        self.position = 0
+
+    def add_shard(self, path):
+        name = os.path.relpath(path, self.directory)
+        if name not in self.shard_numbers:
+            self.shard_numbers[name] = len(self.shards)
+            self.shards.append(name)
+        return self.shard_numbers[name]
+
+    def write(self, target, group, post, text, body_length=None):
+        if body_length is None:
+            body_length = len(json.loads(text)['body'])
+        data = text.encode('utf-8')
+        if self.shard is None or (self.position and self.position + len(data) > self.shard_size):
+            self.new_shard()
+        self.write_entry(Entry(target, group, post, self.shard_number, self.position,
+                               len(data), body_length))
+        # the shards stay valid JSON lines files
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        self.shard.write(data)
+        self.position += len(data)
+
+    def link(self, corpus, target, group, posts):
+        """Adds posts of another packed corpus, referring to its shards."""
+        for post in posts:
+            entry = corpus.entry(target, group, post)
+            shard = self.add_shard(corpus.shard_path(entry.shard))
+            self.write_entry(entry._replace(shard=shard))
+
+    def write_entry(self, entry):
+        self.index.write(json.dumps(list(entry)) + '\n')
+
+    def close(self):
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+        self.index.close()
+        meta_filename = os.path.join(self.directory, META_FILENAME)
+        with open(meta_filename + '.tmp', 'w') as o_f:
+            json.dump({'format': 'packed', 'shards': self.shards}, o_f)
+        os.replace(meta_filename + '.tmp', meta_filename)
+
+
+def create_writer(directory, packed=False):
+    if packed:
+        return PackedWriter(directory)
+    return DirectoryWriter(directory)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+"""
+Running the tasks of a script in a pool of worker processes.
+
+The workers are forked, so they see the module globals of the script as
+they were when the pool was started, e.g. its parsed arguments or an opened
+corpus, and the tasks only need to carry what differs between them.
+"""
+
+import multiprocessing as mp
+
+from tqdm import tqdm
+
+
+def map_tasks(function, tasks, jobs=1, **progress):
+    """Applies the function to every task, in a pool of jobs processes if
+    more than one job is requested. The results are yielded in the order of
+    the tasks either way, with a progress bar that takes the given tqdm
+    options."""
+    if jobs > 1:
+        with mp.Pool(processes=jobs) as pool:
+            yield from tqdm(pool.imap(function, tasks), total=len(tasks), **progress)
+    else:
+        yield from tqdm(map(function, tasks), total=len(tasks), **progress)
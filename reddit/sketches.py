@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Mergeable summaries of a stream of numbers, e.g. document lengths.
+
+Every summary is updated with batches of values, merged with summaries of the
+same kind, and stored as a small JSON-serializable dict, so statistics can be
+collected per file or process and combined afterwards in constant memory:
+
+    Moments         count, sum, sum of squares, minimum and maximum
+    Histogram       counts in fixed-width bins, plus the values beyond them
+    QuantileSketch  quantiles with a bounded relative error (like DDSketch)
+
+and of a stream of strings, e.g. authors:
+
+    HyperLogLog     the number of distinct strings, with a standard error of
+                    1.04 / sqrt(2 ** precision), 0.8% by default
+    HeavyHitters    the most frequent strings (Misra-Gries, the counter
+                    based equivalent of Space-Saving); every count is
+                    underestimated by at most total / (capacity + 1)
+"""
+
+import base64
+import hashlib
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+
+
+class Moments:
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.sumsq = 0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.sumsq += float(np.square(values).sum())
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        for name, pick in (('min', min), ('max', max)):
+            values = [v for v in (getattr(self, name), getattr(other, name)) if v is not None]
+            setattr(self, name, pick(values) if values else None)
+
+    def mean(self):
+        return self.sum / self.count if self.count else float('nan')
+
+    def variance(self):
+        if not self.count:
+            return float('nan')
+        return max(self.sumsq / self.count - self.mean() ** 2, 0.0)
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'sumsq': self.sumsq,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        moments = cls()
+        moments.count = data['count']
+        moments.sum = data['sum']
+        moments.sumsq = data['sumsq']
+        moments.min = data['min']
+        moments.max = data['max']
+        return moments
+
+
+class Histogram:
+    """Counts of the values in n_bins bins of bin_width, starting at 0. Values
+    beyond the last bin are counted in overflow, negative ones in the first
+    bin."""
+
+    def __init__(self, bin_width=100, n_bins=100):
+        self.bin_width = bin_width
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.overflow = 0
+
+    def update(self, values):
+        bins = np.asarray(values, dtype=np.float64) // self.bin_width
+        bins = np.maximum(bins, 0).astype(np.int64)
+        inside = bins < len(self.counts)
+        self.counts += np.bincount(bins[inside], minlength=len(self.counts))
+        self.overflow += int((~inside).sum())
+
+    def merge(self, other):
+        if other.bin_width != self.bin_width or len(other.counts) != len(self.counts):
+            raise ValueError('cannot merge histograms with different bins')
+        self.counts += other.counts
+        self.overflow += other.overflow
+
+    def edges(self):
+        return np.arange(len(self.counts) + 1) * self.bin_width
+
+    def to_dict(self):
+        return {'bin_width': self.bin_width, 'counts': self.counts.tolist(),
+                'overflow': self.overflow}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['bin_width'], len(data['counts']))
+        histogram.counts = np.array(data['counts'], dtype=np.int64)
+        histogram.overflow = data['overflow']
+        return histogram
+
+
+class QuantileSketch:
+    """Counts of the values in logarithmic buckets, so that every quantile
+    is estimated within the relative error. Non-positive values are counted
+    as zeros."""
+
+    def __init__(self, relative_error=0.01):
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.buckets.values())
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64),
+                                 return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        if other.relative_error != self.relative_error:
+            raise ValueError('cannot merge quantile sketches with different errors')
+        self.zeros += other.zeros
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q):
+        count = self.count
+        if not count:
+            return float('nan')
+        rank = q * (count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'relative_error': self.relative_error, 'zeros': self.zeros,
+                'buckets': {str(k): v for k, v in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_error'])
+        sketch.zeros = data['zeros']
+        sketch.buckets = {int(k): v for k, v in data['buckets'].items()}
+        return sketch
+
+
+class Summary:
+    """All of the above for the same values."""
+
+    def __init__(self):
+        self.moments = Moments()
+        self.histogram = Histogram()
+        self.quantiles = QuantileSketch()
+
+    def update(self, values):
+        self.moments.update(values)
+        self.histogram.update(values)
+        self.quantiles.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.quantiles.merge(other.quantiles)
+
+    def to_dict(self):
+        return {'moments': self.moments.to_dict(), 'histogram': self.histogram.to_dict(),
+                'quantiles': self.quantiles.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        summary.moments = Moments.from_dict(data['moments'])
+        summary.histogram = Histogram.from_dict(data['histogram'])
+        summary.quantiles = QuantileSketch.from_dict(data['quantiles'])
+        return summary
+
+
+def hash64(value):
+    """A 64 bit hash of a string that is the same in every process."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def update(self, values):
+        hashes = np.fromiter((hash64(v) for v in values), dtype=np.uint64)
+        if not len(hashes):
+            return
+        bits = 64 - self.precision
+        indices = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64(2 ** bits - 1)
+        # the rank is the position of the first 1 bit of the rest, frexp
+        # gives the bit length exactly since the rest has less than 53 bits
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        ranks = (bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indices, ranks)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLogs with different precisions')
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def cardinality(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def to_dict(self):
+        return {'precision': self.precision,
+                'registers': base64.b64encode(self.registers.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = np.frombuffer(base64.b64decode(data['registers']), dtype=np.uint8).copy()
+        return sketch
+
+
+class HeavyHitters:
+    """Keeps at most capacity counters. When there are more, the count of
+    the (capacity + 1)-th largest counter is subtracted from all of them and
+    the ones that drop to zero are removed, which also makes two summaries
+    mergeable."""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+
+    def update(self, values):
+        self.update_counts(Counter(values))
+
+    def update_counts(self, counts):
+        self.total += sum(counts.values())
+        for value, count in counts.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self.prune()
+
+    def merge(self, other):
+        if other.capacity != self.capacity:
+            raise ValueError('cannot merge heavy hitters with different capacities')
+        self.total += other.total
+        for value, count in other.counters.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self.prune()
+
+    def prune(self):
+        if len(self.counters) <= self.capacity:
+            return
+        threshold = heapq.nlargest(self.capacity + 1, self.counters.values())[-1]
+        self.counters = {v: c - threshold for v, c in self.counters.items() if c > threshold}
+
+    def error_bound(self):
+        return self.total / (self.capacity + 1)
+
+    def top(self, n):
+        """The n most frequent values with their (underestimated) counts."""
+        return heapq.nlargest(n, self.counters.items(), key=lambda x: x[1])
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'total': self.total, 'counters': self.counters}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        sketch.counters = dict(data['counters'])
+        return sketch
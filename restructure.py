@@ -15,16 +15,29 @@ parser.add_argument('-o', '--output-directory', required=True,
 parser.add_argument('-i', '--input-directory', required=True, 
         help='Input directory')
 parser.add_argument('-s', '--subreddit', help='subreddit used for this corpus')
+parser.add_argument('--packed', action='store_true', 
+        help='write a packed corpus instead of one file per comment')
 args = parser.parse_args()
 
 import os 
+import sys
 import glob
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reddit'))
+from packed_corpus import PackedWriter
+
 files = sorted(glob.glob(f'{args.input_directory}/*.json'))
+writer = PackedWriter(args.output_directory) if args.packed else None
 for f in tqdm(files): 
     filename = os.path.basename(f)
     target = os.path.splitext(filename)[0]
+    if writer is not None:
+        # a packed corpus always has a group, the subreddit or ''
+        with open(f) as i_f:
+            for i, comment in enumerate(i_f):
+                writer.write(target, args.subreddit or '', f'{i:06d}.json', comment)
+        continue
     if args.subreddit: 
         out_dir = os.path.join(args.output_directory, target, args.subreddit)
     else:
@@ -36,4 +49,6 @@ for f in tqdm(files):
             out_file = os.path.join(out_dir, f'{i:06d}.json')
             with open(out_file, 'w') as o_f:
                 o_f.write(comment)
+if writer is not None:
+    writer.close()
 
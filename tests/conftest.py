@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the pipeline import each other from the reddit directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reddit'))
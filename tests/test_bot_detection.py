@@ -0,0 +1,18 @@
+import pytest
+
+from bot_detection import BotDetector
+
+
+@pytest.mark.parametrize('ignore_case', [False, True])
+def test_missing_author_is_not_a_bot(ignore_case):
+    detector = BotDetector(['AutoModerator'], ['*_bot'], ignore_case)
+    assert not detector.is_bot(None)
+    assert not detector.is_bot(123)
+
+
+def test_ignore_case():
+    detector = BotDetector(['AutoModerator'], ['*_bot', 're:bot\\d+'], ignore_case=True)
+    assert detector.is_bot('automoderator')
+    assert detector.is_bot('Some_BOT')
+    assert detector.is_bot('BOT42')
+    assert not detector.is_bot('robot_fan')
@@ -0,0 +1,38 @@
+from buckets import MAX_BUCKETS, BucketWriter, bucket_of, bucket_size, count_buckets, read_bucket
+
+
+def write_buckets(directory, lines, n_buckets, buffer_size):
+    with BucketWriter(str(directory), 'writer0', buffer_size) as writer:
+        for line in lines:
+            writer.write(bucket_of(line, n_buckets), line)
+    return [list(read_bucket(str(directory), bucket)) for bucket in range(n_buckets)]
+
+
+def test_tiny_buffer_writes_the_same_buckets(tmp_path):
+    lines = [f'{{"author": "a{i % 37}", "n": {i}}}\n' for i in range(2000)]
+    # one line larger than the buffer
+    lines.append('{"body": "' + 'z' * 1000 + '"}\n')
+    unbounded = write_buckets(tmp_path / 'unbounded', lines, 8, 2 ** 30)
+    buffered = write_buckets(tmp_path / 'buffered', lines, 8, 64)
+    assert buffered == unbounded
+    assert sorted(sum(buffered, [])) == sorted(lines)
+
+
+def test_bucket_larger_than_the_budget(tmp_path):
+    lines = [f'{i}\n' for i in range(1000)]
+    buckets = write_buckets(tmp_path, lines, 1, 16)
+    assert buckets == [lines]
+    size = bucket_size(str(tmp_path), 0)
+    assert size == sum(len(l) for l in lines)
+    # a bucket that does not fit is split, up to the maximum number
+    assert count_buckets(size, size) > 1
+    assert count_buckets(size, 1) == MAX_BUCKETS
+    assert count_buckets(0, 1) == 1
+
+
+def test_split_levels_are_independent():
+    # keys of the same length, whose CRCs at two levels differ by a constant
+    keys = [f'author{i:05d}' for i in range(4000)]
+    first = [k for k in keys if bucket_of(k, 4) == 0]
+    sizes = [sum(1 for k in first if bucket_of(k, 4, level=1) == b) for b in range(4)]
+    assert min(sizes) > len(first) / 8
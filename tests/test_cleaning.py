@@ -0,0 +1,46 @@
+import random
+import re
+import string
+
+from cleaning import clean_and_tokenize
+
+
+def separate_passes(text):
+    """The cleaning and tokenization of 01_filter.py before they were fused."""
+    lines = text.split('\n')
+    text = '\n'.join([x for x in lines if not x.startswith('>')])
+    text = re.sub('\\S*https?:\\/\\/\\S+', '<URL>', text, flags=re.MULTILINE)
+    words = text.translate(str.maketrans('', '', string.punctuation)).split()
+    return text, len(words), len(set(words))
+
+
+TEXTS = [
+    '',
+    '\n',
+    'Just one line.',
+    '> a citation only',
+    '>first\nsecond\n>third',
+    'before\n\n> quoted\n>> nested\n after > not a citation\n',
+    'see https://example.com/a?b=c, and (http://foo.bar/baz).',
+    'link:https://example.com\nnext line http://x.y\n> quoted http://z.w',
+    'not a url: ftp://example.com or https:// alone',
+    'tabs\tand  double  spaces\r\nwindows line\r\n>quote\r\n',
+    "Don't, won't -- can't! Ünïcödé wörds… and emoji 🙂 too.",
+    'same same SAME same, same.',
+    'line\u2028separator\u00a0no-break space',
+]
+
+FRAGMENTS = ['word', 'Word', '>', '> ', '\n', '\n>', ' ', '\t', '.', ',', "'s", '://',
+             'http://a.b/c', 'xhttps://d.e', '(https://f.g)', '<URL>', 'ü', '\r']
+
+
+def test_fused_pass_equals_separate_passes():
+    for text in TEXTS:
+        assert clean_and_tokenize(text) == separate_passes(text), text
+
+
+def test_fused_pass_equals_separate_passes_on_random_texts():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randrange(30)))
+        assert clean_and_tokenize(text) == separate_passes(text), text
@@ -0,0 +1,49 @@
+import os
+import random
+
+from keyed_writer import ThresholdWriter
+
+
+def write_all(directory, rows, threshold, **budget):
+    os.makedirs(directory)
+    writer = ThresholdWriter(str(directory), threshold, **budget)
+    for key, line in rows:
+        writer.add(key, line)
+    n_keys = writer.close()
+    files = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as i_f:
+            files[name] = i_f.read()
+    return n_keys, files
+
+
+def make_rows():
+    rng = random.Random(0)
+    rows = []
+    for i in range(3000):
+        key = f'author{rng.randrange(200)}'
+        rows.append((key, f'{{"id": {i}, "body": "{"x" * rng.randrange(50)}"}}\n'))
+    # a key with more lines than fit into the budget, and a single line
+    # larger than the budget
+    rows.extend(('prolific', f'{{"id": {i}}}\n') for i in range(500))
+    rows.append(('huge', '{"body": "' + 'y' * 5000 + '"}\n'))
+    rng.shuffle(rows)
+    return rows
+
+
+def test_tiny_budget_writes_the_same_files(tmp_path):
+    rows = make_rows()
+    unbounded = write_all(tmp_path / 'unbounded', rows, 5, buffer_size=2 ** 30)
+    spilled = write_all(tmp_path / 'spilled', rows, 5, buffer_size=100, pending_size=100, max_open=3)
+    assert spilled == unbounded
+    assert 'prolific.json' in unbounded[1]
+    assert 'huge.json' not in unbounded[1]
+    # no spill file is left behind
+    assert all(name.endswith('.json') for name in spilled[1])
+
+
+def test_lines_keep_their_order(tmp_path):
+    rows = [(f'k{i % 3}', f'{i}\n') for i in range(30)]
+    n_keys, files = write_all(tmp_path / 'out', rows, 10, buffer_size=1, pending_size=1)
+    assert n_keys == 3
+    assert files['k1.json'] == ''.join(f'{i}\n' for i in range(1, 30, 3))
@@ -0,0 +1,24 @@
+from language_id import NgramIdentifier
+
+ENGLISH = ('I think the main problem with this argument is that nobody really '
+           'checked the numbers before posting them.')
+GERMAN = ('Ich glaube, das eigentliche Problem ist, dass niemand die Zahlen '
+          'vor dem Posten wirklich nachgeprüft hat.')
+
+
+def test_capitals_are_identified_like_lowercase():
+    identifier = NgramIdentifier(languages=['de', 'en', 'so'])
+    results = identifier.identify([ENGLISH.upper(), GERMAN.upper()])
+    assert results[0][0][0] == 'en'
+    assert results[1][0][0] == 'de'
+
+
+def test_mixed_text_is_not_certain():
+    identifier = NgramIdentifier()
+    (language, probability), *_ = identifier.identify([ENGLISH + ' ' + GERMAN])[0]
+    assert probability < 0.99
+    assert identifier.identify([ENGLISH])[0][0][1] > 0.99
+
+
+def test_text_without_words_is_an_error():
+    assert isinstance(NgramIdentifier(languages=['en']).identify(['123 !!!'])[0], ValueError)
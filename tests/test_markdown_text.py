@@ -0,0 +1,58 @@
+import hoep as h
+import pytest
+
+from markdown_text import markdown_to_text, rendered_to_text
+
+
+def fast_text(markdown):
+    """The text of the fast engine of 01_filter.py, or None where it falls
+    back to BeautifulSoup."""
+    text = markdown_to_text(markdown)
+    if text is None:
+        text = rendered_to_text(markdown, h.render(markdown))
+    return text
+
+
+# the expected texts are those of hoep and BeautifulSoup
+CONVERTED = [
+    ('Hello world.\n\nSecond paragraph\nwith a soft break.',
+     'Hello world.\nSecond paragraph\nwith a soft break.\n'),
+    ('line one  \nline two', 'line one\nline two\n'),
+    ('one\r\ntwo\r\n\r\nthree', 'one\ntwo\nthree\n'),
+    ('a\tb\tc', 'a   b   c\n'),
+    ('see [the docs](https://example.com/docs "title") now', 'see the docs now\n'),
+    ('go to https://example.com today', 'go to https://example.com today\n'),
+    ('use `x = 1 * 2` here', 'use x = 1 * 2 here\n'),
+    ('```\ndef f():\n    return 1\n```\nafter', '\ndef f():\n    return 1\n\nafter\n'),
+    ('text\n\n    code line\n    more\n\nend', 'text\ncode line\nmore\n\nend\n'),
+    ('* one\n* two\n    * two a\n    * two b\n* three',
+     '\none\ntwo\n\n\ntwo a\ntwo b\n\nthree\n\n'),
+    ('1. first\n2. second', '\nfirst\nsecond\n\n'),
+    ('> quoted\n> more\n>> nested\n\nreply', '\nquoted\nmore\n\nnested\n\n\nreply\n'),
+    ('# Title\n\ntext', 'Title\ntext\n'),
+    ('*it* **bold** ~~strike~~ ^super', 'it bold ~~strike~~ ^super\n'),
+    ('Tom &amp; Jerry &lt;3 &quot;hi&quot; &#228;&#x20AC;', 'Tom & Jerry <3 "hi" ä€\n'),
+    (r'not \*emphasis\* and \_under\_ \# hash 1\. item',
+     'not *emphasis* and _under_ # hash 1. item\n'),
+]
+
+
+@pytest.mark.parametrize('markdown, expected', CONVERTED)
+def test_fast_engine(markdown, expected):
+    assert fast_text(markdown) == expected
+
+
+@pytest.mark.parametrize('markdown', [
+    'Hello world.\n\nSecond paragraph',
+    'line one  \nline two',
+    'Tom &amp; Jerry &#228;',
+    r'not \*emphasis\*',
+])
+def test_simple_text_needs_no_renderer(markdown):
+    assert markdown_to_text(markdown) is not None
+
+
+@pytest.mark.parametrize('markdown', ['a <b>bold</b> tag', 'fish &chips; &foo;'])
+def test_falls_back_to_beautifulsoup(markdown):
+    assert markdown_to_text(markdown) is None
+    assert rendered_to_text(markdown, h.render(markdown)) is None
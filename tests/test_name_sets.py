@@ -0,0 +1,43 @@
+import pickle
+
+import pytest
+
+from name_sets import MAX_FROZEN_SIZE, NameSet, is_listable, read_names
+
+
+@pytest.fixture(scope='module')
+def hashed():
+    return NameSet(f'author{i}' for i in range(MAX_FROZEN_SIZE + 1))
+
+
+def test_hashed_membership(hashed):
+    assert not hashed.frozen
+    assert len(hashed) == MAX_FROZEN_SIZE + 1
+    for i in (0, 1, 4242, MAX_FROZEN_SIZE):
+        assert f'author{i}' in hashed
+    for name in ('author-1', f'author{MAX_FROZEN_SIZE + 1}', 'Author0', ''):
+        assert name not in hashed
+    # comments without an author
+    assert None not in hashed
+
+
+def test_hashed_names_cannot_be_listed(hashed):
+    assert not is_listable(hashed)
+    with pytest.raises(TypeError):
+        list(hashed)
+
+
+def test_pickling(hashed):
+    # the -j workers get the sets pickled
+    restored = pickle.loads(pickle.dumps(hashed))
+    assert not restored.frozen
+    assert 'author77' in restored and 'author-77' not in restored
+    frozen = pickle.loads(pickle.dumps(NameSet(['alice', 'bob'])))
+    assert frozen.frozen and is_listable(frozen)
+    assert sorted(frozen) == ['alice', 'bob']
+
+
+def test_read_names(tmp_path):
+    filename = tmp_path / 'names.txt'
+    filename.write_text('# allowlist\nalice\n\n  bob  \n#carol\n')
+    assert read_names(filename) == ['alice', 'bob']
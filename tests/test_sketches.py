@@ -0,0 +1,145 @@
+import json
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from sketches import HeavyHitters, Histogram, HyperLogLog, Moments, QuantileSketch, Summary
+
+
+def round_trip(sketch):
+    return type(sketch).from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+
+@pytest.fixture
+def lengths():
+    # document lengths are roughly log-normal, with some empty documents
+    rng = np.random.default_rng(0)
+    values = np.round(rng.lognormal(6, 1.2, 20000))
+    values[:100] = 0
+    rng.shuffle(values)
+    return values
+
+
+def merged(cls, values):
+    """A sketch of the values, merged from sketches of three parts."""
+    sketch = cls()
+    for part in np.array_split(values, 3):
+        other = cls()
+        other.update(part)
+        sketch.merge(other)
+    return sketch
+
+
+def test_moments(lengths):
+    whole = Moments()
+    whole.update(lengths)
+    assert whole.count == len(lengths)
+    assert whole.mean() == pytest.approx(lengths.mean())
+    assert whole.variance() == pytest.approx(lengths.var())
+    assert (whole.min, whole.max) == (lengths.min(), lengths.max())
+    parts = merged(Moments, lengths)
+    assert parts.to_dict() == pytest.approx(whole.to_dict())
+    assert round_trip(whole).to_dict() == whole.to_dict()
+
+
+def test_empty_moments_merge():
+    moments = Moments()
+    moments.merge(Moments())
+    assert moments.count == 0 and moments.min is None
+    other = Moments()
+    other.update([3, 5])
+    moments.merge(other)
+    assert (moments.min, moments.max) == (3, 5)
+
+
+def test_histogram(lengths):
+    whole = Histogram()
+    whole.update(lengths)
+    expected, _ = np.histogram(lengths, bins=whole.edges())
+    assert whole.counts.tolist() == expected.tolist()
+    assert whole.overflow == int((lengths >= whole.edges()[-1]).sum())
+    parts = merged(Histogram, lengths)
+    assert parts.to_dict() == whole.to_dict()
+    assert round_trip(whole).to_dict() == whole.to_dict()
+    with pytest.raises(ValueError):
+        whole.merge(Histogram(bin_width=10))
+
+
+def test_quantile_error(lengths):
+    sketch = QuantileSketch(relative_error=0.01)
+    sketch.update(lengths)
+    exact = np.sort(lengths)
+    for q in (0, 0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999, 1):
+        value = exact[int(q * (len(exact) - 1))]
+        assert sketch.quantile(q) == pytest.approx(value, rel=0.01, abs=1e-9)
+
+
+def test_quantile_merge(lengths):
+    whole = QuantileSketch()
+    whole.update(lengths)
+    parts = merged(QuantileSketch, lengths)
+    assert parts.to_dict() == whole.to_dict()
+    restored = round_trip(whole)
+    assert [restored.quantile(q) for q in (0.1, 0.5, 0.9)] == [whole.quantile(q) for q in (0.1, 0.5, 0.9)]
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_summary_round_trip(lengths):
+    summary = merged(Summary, lengths)
+    restored = round_trip(summary)
+    assert restored.to_dict() == summary.to_dict()
+    assert restored.quantiles.quantile(0.5) == summary.quantiles.quantile(0.5)
+
+
+@pytest.mark.parametrize('n', [10, 1000, 30000, 200000])
+def test_hyperloglog_error(n):
+    sketch = HyperLogLog(precision=14)
+    sketch.update(f'author{i}' for i in range(n))
+    # three standard errors
+    assert abs(sketch.cardinality() - n) <= 3 * 1.04 / 2 ** 7 * n + 1
+
+
+def test_hyperloglog_merge():
+    names = [f'author{i}' for i in range(50000)]
+    whole = HyperLogLog()
+    whole.update(names)
+    # overlapping parts, with repeated names
+    first, second = HyperLogLog(), HyperLogLog()
+    first.update(names[:30000] * 2)
+    second.update(names[20000:])
+    first.merge(second)
+    assert first.cardinality() == whole.cardinality()
+    assert round_trip(first).cardinality() == whole.cardinality()
+    with pytest.raises(ValueError):
+        whole.merge(HyperLogLog(precision=10))
+
+
+def test_heavy_hitters_after_merge():
+    rng = random.Random(0)
+    # a few frequent authors, each more frequent in one half of the stream,
+    # among many rare ones
+    first = [f'rare{rng.randrange(5000)}' for _ in range(20000)] + ['bot'] * 3000 + ['alice'] * 2500 + ['bob'] * 500
+    second = [f'rare{rng.randrange(5000)}' for _ in range(20000)] + ['bot'] * 1000 + ['alice'] * 500 + ['bob'] * 2500
+    rng.shuffle(first)
+    rng.shuffle(second)
+    sketches = []
+    for part in (first, second):
+        sketch = HeavyHitters(capacity=20)
+        for start in range(0, len(part), 1000):
+            sketch.update(part[start:start + 1000])
+        sketches.append(sketch)
+    merged, other = sketches
+    merged.merge(other)
+    merged = round_trip(merged)
+
+    exact = Counter(first + second)
+    assert merged.total == len(first) + len(second)
+    assert [value for value, _ in merged.top(3)] == ['bot', 'alice', 'bob']
+    for value, count in merged.counters.items():
+        assert exact[value] - merged.error_bound() <= count <= exact[value]
+    # every value more frequent than the error bound is kept
+    for value, count in exact.items():
+        if count > merged.error_bound():
+            assert value in merged.counters